@@ -0,0 +1,243 @@
+from ggp.kif import Struct, Var, LogicalSentence
+from ggp.ground import normalize, plan, bindings, substitute, variables, \
+     POSITIVE, NEGATIVE, DIFFERENT, EQUAL
+from ggp.util import stronglyConnected, setMapAdd
+
+TRUE = ('true', 1)
+DOES = ('does', 2)
+INIT = ('init', 1)
+NEXT = ('next', 1)
+# Relations the simulators query, directly or through init
+ROOTS = set([('role', 1), ('init', 1), ('next', 1), ('legal', 2),
+             ('goal', 2), ('terminal', 0)])
+
+def predicate(s):
+    return (s.name, s.arity())
+
+def sentenceVariables(s, acc=None):
+    if acc is None:
+        acc = set()
+    if s.__class__ == LogicalSentence:
+        for x in s.sents:
+            sentenceVariables(x, acc)
+    else:
+        variables(s, acc)
+    return acc
+
+def conjuncts(s):
+    "Top-level conjuncts of a rule body sentence"
+    if s.__class__ == LogicalSentence and s.op == 'and':
+        return [c for x in s.sents for c in conjuncts(x)]
+    return [s]
+
+class BodyOrderer:
+    """
+    Reorders the conjuncts of rule bodies so that the most
+    selective literals come first.  The number of solutions
+    of a literal is estimated from the domain sizes of the
+    positions of its unbound variables.  distinct, not and
+    other compound conjuncts are checks: each is placed as
+    soon as its variables are bound.
+    """
+    def __init__(self, gd):
+        self.gd = gd
+
+    def domainSize(self, rd):
+        return max(1, len(self.gd.domains.get(rd, ())))
+
+    def termCost(self, t, rd, bound):
+        if t.__class__ == Var:
+            if t in bound:
+                return 1
+            return self.domainSize(rd)
+        cost = 1
+        for i, x in enumerate(t.terms):
+            cost *= self.termCost(x, t.relationDomain(i), bound)
+        return cost
+
+    def cost(self, lit, bound):
+        if predicate(lit) == DOES:
+            # At most one move per role
+            if variables(lit.terms[0]) <= bound:
+                return 1
+            return len(self.gd.roles)
+        return self.termCost(lit, None, bound)
+
+    def isCheck(self, c):
+        return c.__class__ != Struct or c.name == 'distinct'
+
+    def order(self, sent):
+        "Same rule with its body reordered"
+        if sent.__class__ == Struct or sent.op != '<=' or len(sent.sents) < 3:
+            return sent
+        body = []
+        for x in sent.sents[1:]:
+            body.extend(conjuncts(x))
+        occurs = [sentenceVariables(c) for c in body]
+        # A check waits for the variables that other conjuncts bind
+        needs = []
+        for i in range(len(body)):
+            others = set()
+            for j, vs in enumerate(occurs):
+                if j != i:
+                    others |= vs
+            needs.append(occurs[i] & others)
+        pending = range(len(body))
+        ordered = []
+        bound = set()
+        while pending:
+            ready = [i for i in pending \
+                     if self.isCheck(body[i]) and needs[i] <= bound]
+            if not ready:
+                literals = [i for i in pending if not self.isCheck(body[i])]
+                if literals:
+                    ready = [min(literals, key=lambda i: self.cost(body[i], bound))]
+                else:
+                    ready = pending[:1]
+            for i in ready:
+                pending.remove(i)
+                ordered.append(body[i])
+                bound |= occurs[i]
+        return LogicalSentence('<=', [sent.sents[0]] + ordered)
+
+
+class RuleAnalysis:
+    """
+    Static analysis of the rules of a game description.
+
+    Builds the predicate dependency graph, checks that negation
+    is stratified, evaluates the static relations (those that
+    depend on neither true nor does) into fact tables and drops
+    the rules that no simulator query can reach.  The smaller
+    rule set, with bodies reordered by BodyOrderer, is kept in
+    rules and initRules.
+
+    Predicates are (name, arity) pairs.
+    """
+    def __init__(self, gd):
+        self.gd = gd
+        orderer = BodyOrderer(gd)
+        initRules = [orderer.order(s) for s in gd.initRules]
+        rules = [orderer.order(s) for s in gd.rules]
+        self.normalized = []
+        for s in initRules + rules:
+            self.normalized.extend(normalize(s))
+
+        # Whether some true or next literal has a variable as
+        # its fluent, which rules out per-functor fluent predicates
+        self.variableFluents = False
+        for rule in self.normalized:
+            for s in [rule.head] + [s for k, s in rule.body]:
+                if (predicate(s) == TRUE or predicate(s) == NEXT) and \
+                   s.terms[0].__class__ == Var:
+                    self.variableFluents = True
+
+        self.graph = {}
+        self.negated = {}
+        for rule in self.normalized:
+            head = predicate(rule.head)
+            self.graph.setdefault(head, set())
+            for kind, s in rule.body:
+                if kind == POSITIVE or kind == NEGATIVE:
+                    self.graph[head].add(predicate(s))
+                    self.graph.setdefault(predicate(s), set())
+                if kind == NEGATIVE:
+                    setMapAdd(self.negated, head, predicate(s))
+        self.components = stronglyConnected(self.graph)
+        self.component = {}
+        for i, component in enumerate(self.components):
+            for p in component:
+                self.component[p] = i
+        for head, preds in self.negated.items():
+            for p in preds:
+                if self.component[p] == self.component[head]:
+                    raise Exception('Rules are not stratified: ' + head[0])
+
+        self.static = set()
+        for component in self.components:
+            static = True
+            for p in component:
+                if p == TRUE or p == DOES:
+                    static = False
+                for q in self.graph[p]:
+                    if q not in component and q not in self.static:
+                        static = False
+            if static:
+                self.static.update(component)
+
+        self.relevant = set()
+        pending = [p for p in ROOTS if p in self.graph]
+        while pending:
+            p = pending.pop()
+            if p in self.relevant:
+                continue
+            self.relevant.add(p)
+            if p not in self.static:
+                pending.extend(self.graph[p])
+
+        self.facts = {}
+        self.evaluateStatic()
+        self.rules = []
+        for s in rules:
+            if s.__class__ == Struct:
+                head = predicate(s)
+            else:
+                head = predicate(s.sents[0])
+            if head in self.relevant and head not in self.static:
+                self.rules.append(s)
+        for p in self.inOrder(self.static & self.relevant):
+            if p != INIT:
+                self.rules.extend(sorted(self.facts.get(p, ()), key=str))
+        if INIT in self.static:
+            self.initRules = sorted(self.facts.get(INIT, ()), key=str)
+        else:
+            self.initRules = initRules
+
+    def inOrder(self, preds):
+        "Predicates in dependency order"
+        return [p for c in self.components for p in c if p in preds]
+
+    def isRecursive(self, p):
+        component = self.components[self.component[p]]
+        return len(component) > 1 or p in self.graph[p]
+
+    def recursive(self):
+        "Recursive relations left in rules, in dependency order"
+        return [p for p in self.inOrder(self.relevant - self.static) \
+                if self.isRecursive(p)]
+
+    def dependsOn(self, preds, target):
+        "Whether any of preds depends on target"
+        seen = set()
+        pending = list(preds)
+        while pending:
+            p = pending.pop()
+            if p == target:
+                return True
+            if p not in seen:
+                seen.add(p)
+                pending.extend(self.graph.get(p, ()))
+        return False
+
+    def evaluateStatic(self):
+        """
+        Evaluate the static relations bottom-up, one strongly
+        connected component at a time
+        """
+        for component in self.components:
+            if component[0] not in self.static:
+                continue
+            steps = [(rule, plan(rule)) for rule in self.normalized \
+                     if predicate(rule.head) in component]
+            changed = True
+            while changed:
+                changed = False
+                for rule, ruleSteps in steps:
+                    heads = [substitute(rule.head, b) for b in bindings(ruleSteps, self.facts, True)]
+                    for h in heads:
+                        facts = self.facts.setdefault(predicate(h), set())
+                        if h not in facts:
+                            facts.add(h)
+                            changed = True
+                if not self.isRecursive(component[0]):
+                    break
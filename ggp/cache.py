@@ -1,47 +1,145 @@
-class FIFOCache:
+import sys
+
+def approximateSize(x, depth=2):
+    """
+    Bytes used by x and, down to depth levels, by the objects
+    it holds: items of lists, tuples, sets and dicts and
+    attributes of instances
+    """
+    size = sys.getsizeof(x)
+    if depth == 0:
+        return size
+    if isinstance(x, dict):
+        for k, v in x.items():
+            size += approximateSize(k, depth - 1) + approximateSize(v, depth - 1)
+    elif isinstance(x, (list, tuple, set, frozenset)):
+        for y in x:
+            size += approximateSize(y, depth - 1)
+    elif hasattr(x, '__dict__'):
+        size += approximateSize(x.__dict__, depth)
+    return size
+
+
+class ClockCache:
     """
-    First-in / First-out cache
-    to speed up key-value lookups
+    Cache bounded by an estimate of its size in bytes, with
+    CLOCK eviction: each entry has a reference bit, set when it
+    is read, and the clock hand evicts the first entry it finds
+    with a clear bit, clearing the bits it passes.  Entries that
+    are read again survive a full turn of the hand.
+
+    Sizes come from sizeof(key, value), computed when an entry
+    is set.  Values that grow after being stored should be set
+    again to update their size.  An entry larger than the whole
+    capacity is not stored, and drops the key if it was.  get
+    counts hits and misses.
     """
-    class __Node:
-        def __init__(self):
-            self.key = None
-            self.val = None
-        def __repr__(self):
-            return '(key: ' + str(self.key) + ', ' + \
-                   'val: ' + str(self.val) + ')'
-
-    def __init__(self, capacity=4096):
+    def __init__(self, capacity=64 * 1024 * 1024, sizeof=None):
         self.capacity = capacity
-        self.current = 0
-        self.__keys = {}
-        self.__nodes = [self.__Node() for _ in range(capacity)]
+        if sizeof is None:
+            sizeof = lambda k, v: approximateSize(k) + approximateSize(v)
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.hand = 0
+        self.slots = {}
+        self.keys = []
+        self.values = []
+        self.sizes = []
+        self.referenced = []
+        self.free = []
 
     def __len__(self):
-        return len(self.__nodes)
+        return len(self.slots)
 
     def __contains__(self, key):
-        return self.__keys.has_key(key)
+        return key in self.slots
+
+    def __getitem__(self, key):
+        i = self.slots[key]
+        self.referenced[i] = True
+        return self.values[i]
+
+    def get(self, key, default=None):
+        try:
+            i = self.slots[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.referenced[i] = True
+        return self.values[i]
 
     def __setitem__(self, key, obj):
-        if self.__keys.has_key(key):
-            self.__nodes[self.__keys[key]].val = obj
+        size = self.sizeof(key, obj)
+        i = self.slots.get(key)
+        if size > self.capacity:
+            if i is not None:
+                self.remove(i)
+            return
+        if i is not None:
+            self.size += size - self.sizes[i]
+            self.values[i] = obj
+            self.sizes[i] = size
+            self.referenced[i] = True
+            while self.size > self.capacity and len(self.slots) > 1:
+                self.evict(i)
+            return
+        while self.size + size > self.capacity and len(self.slots) > 0:
+            self.evict()
+        if self.free:
+            i = self.free.pop()
+            self.keys[i] = key
+            self.values[i] = obj
+            self.sizes[i] = size
+            self.referenced[i] = False
         else:
-            node = self.__nodes[self.current]
-            if node.key and node.key in self.__keys:
-                del self.__keys[node.key]
-            node.key = key
-            node.val = obj
-            self.__keys[key] = self.current
-            self.current += 1
-            if self.current == self.capacity:
-                # Empty cache when full
-                self.current = 0
-        
-    def __getitem__(self, key):
-        return self.__nodes[self.__keys[key]].val
+            i = len(self.keys)
+            self.keys.append(key)
+            self.values.append(obj)
+            self.sizes.append(size)
+            self.referenced.append(False)
+        self.slots[key] = i
+        self.size += size
+
+    def __delitem__(self, key):
+        self.remove(self.slots[key])
+
+    def remove(self, i):
+        del self.slots[self.keys[i]]
+        self.size -= self.sizes[i]
+        self.keys[i] = None
+        self.values[i] = None
+        self.sizes[i] = 0
+        self.referenced[i] = False
+        self.free.append(i)
+
+    def evict(self, keep=None):
+        "Evict one entry other than slot keep"
+        n = len(self.keys)
+        while True:
+            i = self.hand
+            self.hand = (i + 1) % n
+            if self.keys[i] is None or i == keep:
+                continue
+            if self.referenced[i]:
+                self.referenced[i] = False
+            else:
+                self.remove(i)
+                self.evictions += 1
+                return
+
+    def clear(self):
+        self.__init__(self.capacity, self.sizeof)
+
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return float(self.hits) / lookups
 
     def __iter__(self):
-        for k in self.__keys:
+        for k in self.slots.keys():
             yield k
-        raise StopIteration
@@ -0,0 +1,364 @@
+import os
+import imp
+import hashlib
+from ggp.kif import Struct, Var
+from ggp.ground import normalize, plan, DIFFERENT, EQUAL, NEGATIVE
+from ggp.util import stronglyConnected, listMapAdd
+from ggp.sim import randomPlayout
+
+# Directory holding the generated rule modules: GGP_CACHE_DIR if
+# set, otherwise build/gdl next to the ggp package
+CACHE_DIR = os.environ.get('GGP_CACHE_DIR') or \
+            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         'build', 'gdl')
+# Bump when the generated code changes
+COMPILER_VERSION = '1'
+
+MODULE_HEADER = '''# Generated by ggp.compiler from GDL rules.  Do not edit.
+EMPTY = ()
+ONCE = (0,)
+
+def _key(v):
+    if v.__class__ is tuple:
+        return (v[0], len(v))
+    return v
+'''
+
+def predicate(s):
+    return s.name + '/' + str(s.arity())
+
+def structValue(s):
+    """
+    Runtime value of a ground term: the name of a constant,
+    or a (name, arg1, ..., argN) tuple
+    """
+    if s.arity() == 0:
+        return s.name
+    return tuple([s.name] + [structValue(t) for t in s.terms])
+
+def valueStruct(v):
+    if v.__class__ is tuple:
+        return Struct(v[0], [valueStruct(x) for x in v[1:]])
+    return Struct(v, [])
+
+def valueKey(v):
+    "Index key of a runtime value, as computed by _key"
+    if v.__class__ is tuple:
+        return (v[0], len(v))
+    return v
+
+
+class RuleCompiler:
+    """
+    Translates a normalized rule into a Python function
+    f(F, ix, out) with one nested loop per positive literal.
+    F maps each predicate to its set of argument tuples and
+    ix(pred) returns those tuples indexed by the key of their
+    first argument.  Head tuples are added to out.
+    """
+    def __init__(self, rule, name):
+        self.rule = rule
+        self.name = name
+        self.lines = []
+        self.depth = 1
+        self.bound = {}
+        self.temps = 0
+
+    def emit(self, line):
+        self.lines.append('    ' * self.depth + line)
+
+    def temp(self, prefix):
+        self.temps += 1
+        return '%s%d' % (prefix, self.temps)
+
+    def isBound(self, t):
+        if t.__class__ == Var:
+            return t in self.bound
+        for x in t.terms:
+            if not self.isBound(x):
+                return False
+        return True
+
+    def value(self, t):
+        "Expression for the value of a bound term"
+        if t.__class__ == Var:
+            return self.bound[t]
+        if t.arity() == 0:
+            return repr(t.name)
+        return '(' + ', '.join([repr(t.name)] + [self.value(x) for x in t.terms]) + ')'
+
+    def args(self, terms):
+        values = [self.value(t) for t in terms]
+        if len(values) == 1:
+            return '(' + values[0] + ',)'
+        return '(' + ', '.join(values) + ')'
+
+    def key(self, t):
+        "Expression for the index key of a term, if it is known"
+        if t.__class__ == Var:
+            if t in self.bound:
+                return '_key(' + self.bound[t] + ')'
+            return None
+        if t.arity() == 0:
+            return repr(t.name)
+        return repr((t.name, t.arity() + 1))
+
+    def match(self, pattern, expr):
+        if self.isBound(pattern):
+            self.emit('if %s != %s: continue' % (expr, self.value(pattern)))
+        elif pattern.__class__ == Var:
+            self.bound[pattern] = self.temp('v')
+            self.emit('%s = %s' % (self.bound[pattern], expr))
+        else:
+            t = self.temp('t')
+            self.emit('%s = %s' % (t, expr))
+            self.emit('if %s.__class__ is not tuple or len(%s) != %d or %s[0] != %r: continue' % \
+                      (t, t, pattern.arity() + 1, t, pattern.name))
+            for i, x in enumerate(pattern.terms):
+                self.match(x, '%s[%d]' % (t, i + 1))
+
+    def positive(self, lit):
+        pred = predicate(lit)
+        if self.isBound(lit):
+            self.emit('if %s not in F.get(%r, EMPTY): continue' % (self.args(lit.terms), pred))
+            return
+        key = self.key(lit.terms[0])
+        if key is None:
+            source = 'F.get(%r, EMPTY)' % pred
+        else:
+            source = 'ix(%r).get(%s, EMPTY)' % (pred, key)
+        fact = self.temp('f')
+        self.emit('for %s in %s:' % (fact, source))
+        self.depth += 1
+        for i, x in enumerate(lit.terms):
+            self.match(x, '%s[%d]' % (fact, i))
+
+    def check(self, kind, s):
+        if kind == DIFFERENT:
+            self.emit('if %s == %s: continue' % (self.value(s.terms[0]), self.value(s.terms[1])))
+        elif kind == EQUAL:
+            self.emit('if %s != %s: continue' % (self.value(s.terms[0]), self.value(s.terms[1])))
+        elif kind == NEGATIVE:
+            self.emit('if %s in F.get(%r, EMPTY): continue' % (self.args(s.terms), predicate(s)))
+
+    def compile(self):
+        self.lines.append('def %s(F, ix, out):' % self.name)
+        # Wrap the body in a loop so that a failed check can always continue
+        self.emit('for _ in ONCE:')
+        self.depth += 1
+        for lit, checks in plan(self.rule):
+            if lit is not None:
+                self.positive(lit)
+            for kind, s in checks:
+                self.check(kind, s)
+        self.emit('out.add(%s)' % self.args(self.rule.head.terms))
+        return '\n'.join(self.lines) + '\n'
+
+
+def compileRules(rules):
+    "Source of a module defining RULES, a list of (predicate, function)"
+    parts = [MODULE_HEADER]
+    names = []
+    for i, rule in enumerate(rules):
+        name = 'rule%d' % i
+        parts.append(RuleCompiler(rule, name).compile())
+        names.append('    (%r, %s),' % (predicate(rule.head), name))
+    parts.append('RULES = [\n' + '\n'.join(names) + '\n]\n')
+    return '\n'.join(parts)
+
+def loadModule(sents, rules):
+    """
+    Generated module for the rules, cached in CACHE_DIR and
+    keyed by a hash of the rule text
+    """
+    text = COMPILER_VERSION + '\n' + '\n'.join([str(s) for s in sents])
+    digest = hashlib.sha1(text).hexdigest()
+    name = 'gdl_' + digest
+    path = os.path.join(CACHE_DIR, name + '.py')
+    if not os.path.exists(path):
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        tmp = path + '.' + str(os.getpid())
+        out = open(tmp, 'w')
+        out.write(compileRules(rules))
+        out.close()
+        os.rename(tmp, path)
+    return imp.load_source(name, path)
+
+
+class CompiledRules:
+    """
+    Bottom-up evaluation of the generated rule functions,
+    predicate stratum by predicate stratum.  Predicates that
+    depend on neither true nor does are evaluated once.
+    """
+    def __init__(self, sents):
+        rules = []
+        for s in sents:
+            rules.extend(normalize(s))
+        self.module = loadModule(sents, rules)
+        self.functions = {}
+        for pred, fn in self.module.RULES:
+            listMapAdd(self.functions, pred, fn)
+
+        graph = {}
+        for rule in rules:
+            head = predicate(rule.head)
+            graph.setdefault(head, set())
+            for kind, s in rule.body:
+                if kind != DIFFERENT and kind != EQUAL:
+                    graph[head].add(predicate(s))
+        self.static = []
+        self.state = []
+        self.moves = []
+        dependsOn = {'true/1': 'state', 'does/2': 'moves'}
+        for component in stronglyConnected(graph):
+            phase = 'static'
+            for p in component:
+                for q in graph.get(p, ()):
+                    d = dependsOn.get(q, 'static')
+                    if d == 'moves' or (d == 'state' and phase == 'static'):
+                        phase = d
+            for p in component:
+                if p not in dependsOn:
+                    dependsOn[p] = phase
+            preds = [p for p in component if p in self.functions]
+            if len(preds) == 0:
+                continue
+            recursive = len(component) > 1 or component[0] in graph.get(component[0], ())
+            if recursive:
+                for rule in rules:
+                    if predicate(rule.head) in component:
+                        for kind, s in rule.body:
+                            if kind == NEGATIVE and predicate(s) in component:
+                                raise Exception('Rules are not stratified: ' + str(rule))
+            getattr(self, phase).append((preds, recursive))
+        self.staticFacts = self.evaluate({}, {}, self.static)
+
+    def evaluate(self, facts, indexes, strata):
+        """
+        Evaluate the strata on top of the given facts and
+        indexes, which are copied first.  Returns the new
+        (facts, indexes) pair.
+        """
+        facts = dict(facts)
+        indexes = dict(indexes)
+        def ix(pred):
+            try:
+                return indexes[pred]
+            except KeyError:
+                index = {}
+                for f in facts.get(pred, ()):
+                    index.setdefault(valueKey(f[0]), []).append(f)
+                indexes[pred] = index
+                return index
+        functions = self.functions
+        for preds, recursive in strata:
+            while True:
+                changed = False
+                new = []
+                for p in preds:
+                    out = set()
+                    for fn in functions[p]:
+                        fn(facts, ix, out)
+                    new.append((p, out))
+                for p, out in new:
+                    old = facts.get(p)
+                    if old is None:
+                        facts[p] = out
+                        changed = changed or len(out) > 0
+                    else:
+                        n = len(old)
+                        old |= out
+                        changed = changed or len(old) != n
+                    indexes.pop(p, None)
+                if not recursive or not changed:
+                    break
+        return facts, indexes
+
+
+class CompiledSimulator:
+    """
+    Simulator running GDL rules compiled to Python functions
+    by RuleCompiler.  Same interface as PrologSimulator.
+    """
+    def __init__(self, gd):
+        self.gd = gd
+        self.rules = CompiledRules(gd.analysis.rules)
+        self.roleValues = [structValue(r) for r in gd.roles]
+        self.roleIndex = dict([(v, i) for i, v in enumerate(self.roleValues)])
+        self.fluentValues = {}
+        self.fluentIndexes = {}
+        self.state = None
+        self.evaluation = None
+
+    def cleanup(self):
+        pass
+
+    def fluentValue(self, i):
+        try:
+            return self.fluentValues[i]
+        except KeyError:
+            v = structValue(self.gd.stateTerm(i))
+            self.fluentValues[i] = v
+            self.fluentIndexes[v] = i
+            return v
+
+    def fluentIndex(self, v):
+        try:
+            return self.fluentIndexes[v]
+        except KeyError:
+            i = self.gd.stateIndex(valueStruct(v))
+            self.fluentValues[i] = v
+            self.fluentIndexes[v] = i
+            return i
+
+    def assertTrue(self, state):
+        if self.state != state:
+            self.state = state
+            facts, indexes = self.rules.staticFacts
+            facts = dict(facts)
+            facts['true/1'] = set([(self.fluentValue(i),) for i in state])
+            self.evaluation = self.rules.evaluate(facts, indexes, self.rules.state)
+
+    def facts(self, pred):
+        return self.evaluation[0].get(pred, ())
+
+    def isTerminal(self, state):
+        self.assertTrue(state)
+        return len(self.facts('terminal/0')) > 0
+
+    def computeGoals(self, state):
+        self.assertTrue(state)
+        results = [None for _ in self.gd.roles]
+        for r, g in self.facts('goal/2'):
+            i = self.roleIndex[r]
+            if results[i] is None:
+                results[i] = int(g)
+        for r, g in enumerate(results):
+            if g is None:
+                raise Exception('No goal value for role: ' + \
+                                str(self.gd.roleTerm(r)))
+        return results
+
+    def computeLegalMoves(self, state):
+        self.assertTrue(state)
+        results = [[] for _ in self.gd.roles]
+        for r, m in self.facts('legal/2'):
+            results[self.roleIndex[r]].append(self.gd.moveIndex(valueStruct(m)))
+        return results
+
+    def computeNextState(self, state, moves):
+        self.assertTrue(state)
+        facts, indexes = self.evaluation
+        facts = dict(facts)
+        facts['does/2'] = set([(self.roleValues[r], structValue(self.gd.moveTerm(m))) \
+                               for r, m in enumerate(moves)])
+        facts, _ = self.rules.evaluate(facts, indexes, self.rules.moves)
+        return self.gd.makeState([self.fluentIndex(v) for v, in facts.get('next/1', ())])
+
+    def computeAllNextStates(self, state, jointMovesList):
+        return [self.computeNextState(state, moves) for moves in jointMovesList]
+
+    def playout(self, state, seed, policy='random', recordMoves=False):
+        return randomPlayout(self, state, seed, policy, recordMoves)
@@ -0,0 +1,187 @@
+from ggp.ground import Grounding
+from ggp.util import stronglyConnected
+
+class Factoring:
+    """
+    Splits a game into independent subgames.  Two fluents are in
+    the same factor when one is computed from the other by a next
+    rule, and a move joins the factor of the fluents that its
+    legality and its effects depend on.  Frame rules, which keep
+    a fluent as it is, link no move to it.  The analysis runs on the
+    grounded rules, so fluents of the same functor can end up in
+    different factors.
+
+    Fluents that no move affects, directly or through other
+    fluents, such as a step counter, join no factor: rules that
+    read them would otherwise merge every factor into one.
+
+    factors holds one (fluents, moves) pair of sets per factor,
+    with fluents as state indexes and moves as (role, move index)
+    pairs.  Fluents that no move affects are in shared and moves
+    that affect no fluent are in free; both belong to every
+    factor.  Searching the factors separately and combining
+    their values is left to the caller.
+    """
+    def __init__(self, gd, grounding=None):
+        self.gd = gd
+        if grounding is None:
+            grounding = Grounding(gd)
+        roles = dict([(r, i) for i, r in enumerate(gd.roles)])
+
+        graph = {}
+        for r in grounding.rules:
+            if r.head.name != 'init':
+                graph.setdefault(r.head, set()).update(r.pos + r.neg)
+        for atoms in graph.values():
+            for a in list(atoms):
+                graph.setdefault(a, set())
+        # Fluents and moves each atom depends on
+        leaves = {}
+        for component in stronglyConnected(graph):
+            found = set()
+            for a in component:
+                if a.name == 'true':
+                    found.add(('fluent', gd.stateIndex(a.terms[0])))
+                elif a.name == 'does':
+                    found.add(('move', (roles[a.terms[0]], gd.moveIndex(a.terms[1]))))
+                for b in graph[a]:
+                    if b not in component:
+                        found |= leaves[b]
+            for a in component:
+                leaves[a] = found
+        # A frame rule, whose body holds the fluent of its head,
+        # only keeps that fluent as it is, so its moves do not
+        # join the factor of the fluent.  They still make the
+        # fluent depend on moves.
+        links = dict(leaves)
+        effects = {}
+        for r in grounding.rules:
+            if r.head.name == 'next':
+                found = effects.setdefault(r.head, set())
+                fluent = r.head.terms[0]
+                frame = len([a for a in r.pos \
+                             if a.name == 'true' and a.terms[0] == fluent]) > 0
+                for b in r.pos + r.neg:
+                    found.update([l for l in leaves[b] if not frame or l[0] != 'move'])
+        links.update(effects)
+
+        independent = self.independentFluents(graph, leaves)
+        self.parent = {}
+        for a in graph:
+            if a.name == 'next':
+                node = ('fluent', gd.stateIndex(a.terms[0]))
+                if node[1] in independent:
+                    continue
+            elif a.name == 'legal':
+                node = ('move', (roles[a.terms[0]], gd.moveIndex(a.terms[1])))
+            else:
+                continue
+            self.find(node)
+            for leaf in links[a]:
+                if leaf[0] != 'fluent' or leaf[1] not in independent:
+                    self.union(node, leaf)
+
+        groups = {}
+        for node in self.parent:
+            groups.setdefault(self.find(node), []).append(node)
+        self.factors = []
+        self.shared = set(independent)
+        self.free = set()
+        for nodes in groups.values():
+            fluents = set([x for kind, x in nodes if kind == 'fluent'])
+            moves = set([x for kind, x in nodes if kind == 'move'])
+            if len(moves) == 0:
+                self.shared |= fluents
+            elif len(fluents) == 0:
+                self.free |= moves
+            else:
+                self.factors.append((fluents, moves))
+        self.factors.sort(key=lambda f: min(f[0]))
+
+    def independentFluents(self, graph, leaves):
+        "Fluents whose next rules depend on no move, even through other fluents"
+        fluents = set()
+        reads = {}
+        for a in graph:
+            if a.name == 'true' or a.name == 'next':
+                fluents.add(self.gd.stateIndex(a.terms[0]))
+            if a.name == 'next':
+                reads[self.gd.stateIndex(a.terms[0])] = leaves[a]
+        independent = set(fluents)
+        changed = True
+        while changed:
+            changed = False
+            for i in list(independent):
+                for kind, x in reads.get(i, ()):
+                    if kind == 'move' or x not in independent:
+                        independent.discard(i)
+                        changed = True
+                        break
+        return independent
+
+    def find(self, node):
+        root = self.parent.setdefault(node, node)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        while node != root:
+            self.parent[node], node = root, self.parent[node]
+        return root
+
+    def union(self, a, b):
+        self.parent[self.find(a)] = self.find(b)
+
+    def project(self, state, i):
+        "The fluents of state that factor i sees"
+        fluents = self.factors[i][0]
+        return self.gd.makeState([x for x in state \
+                                  if x in fluents or x in self.shared])
+
+    def views(self, sim):
+        return [FactorSimulator(sim, self, i) for i in range(len(self.factors))]
+
+
+class FactorSimulator:
+    """
+    View of a simulator restricted to one factor of a Factoring.
+    States are projected on the fluents of the factor and each
+    role only gets its legal moves in the factor and its free
+    moves, or all of them if that leaves none.  Terminal and
+    goal values are those of the projected state, so they are
+    only meaningful for games whose goal and terminal
+    conditions split by factor.  It is not a drop-in simulator
+    for Search, which does not combine per-factor values.
+    """
+    def __init__(self, sim, factoring, index):
+        self.sim = sim
+        self.factoring = factoring
+        self.index = index
+        self.gd = factoring.gd
+        self.moves = factoring.factors[index][1] | factoring.free
+
+    def project(self, state):
+        return self.factoring.project(state, self.index)
+
+    def isTerminal(self, state):
+        return self.sim.isTerminal(self.project(state))
+
+    def computeGoals(self, state):
+        return self.sim.computeGoals(self.project(state))
+
+    def computeLegalMoves(self, state):
+        results = []
+        for r, legal in enumerate(self.sim.computeLegalMoves(self.project(state))):
+            moves = [m for m in legal if (r, m) in self.moves]
+            if len(moves) == 0:
+                moves = legal
+            results.append(moves)
+        return results
+
+    def computeNextState(self, state, moves):
+        return self.project(self.sim.computeNextState(self.project(state), moves))
+
+    def computeAllNextStates(self, state, jointMovesList):
+        return [self.project(s) for s in \
+                self.sim.computeAllNextStates(self.project(state), jointMovesList)]
+
+    def __getattr__(self, attr):
+        return getattr(self.sim, attr)
@@ -1,5 +1,8 @@
+import random
+import weakref
 from ggp.kif import *
 from ggp.util import setMapAdd
+from ggp.analysis import RuleAnalysis
 
 ROLE = Functor('role', 1)
 INIT = Functor('init', 1)
@@ -13,7 +16,19 @@ DISTINCT = Functor('distinct', 2)
 
 class GameDescription:
     "GDL Game Description"
-    def __init__(self, filename = ''):
+    def __init__(self, filename = '', stateClass = None, interning = True):
+        if stateClass is None:
+            stateClass = State
+        self.stateClass = stateClass
+        # Shared States by hash, see intern
+        self.interning = interning and stateClass == State
+        self.internTable = weakref.WeakValueDictionary()
+        # Zobrist keys: a random signed 64-bit key per fluent index
+        # and per (role, move index), drawn from this game's own
+        # seeded generator
+        self.zobristKeys = []
+        self.zobristMoveKeys = {}
+        self.zobristRandom = random.Random(0x5eed)
         self.roles = []
         self.rules = []
         self.initRules = []
@@ -45,6 +60,8 @@ class GameDescription:
         self.movePrologTerms = []
         self.statePrologTermsInv = {}
         self.movePrologTermsInv = {}
+        self.stateValueInv = {}
+        self.moveValueInv = {}
 
         self.SV = {}
         self.ROT = {}
@@ -91,7 +108,7 @@ class GameDescription:
                 varOccur.extend(s.varOccur().values())
                 self.rules.append(s)
             self.processFunctions(s)
-        self.initialState = State([self.stateIndex(t) for t in initTerms])
+        self.initialState = self.makeState([self.stateIndex(t) for t in initTerms])
 
         self.domains[RelationDomain(TRUE, 0)] = self.stateVars
         self.domains[RelationDomain(NEXT, 0)] = self.stateVars
@@ -122,6 +139,7 @@ class GameDescription:
                 self.uniteSet(srd)
 
         self.goals = set([int(f.name) for f in self.domains[RelationDomain(GOAL, 1)]])
+        self.analysis = RuleAnalysis(self)
             
             
     def uniteSet(self, s):
@@ -260,6 +278,64 @@ class GameDescription:
     def lowestReward(self):
         return min(self.goals)
 
+    def makeState(self, indexes):
+        if self.stateClass != State:
+            return self.stateClass(indexes)
+        state = State(indexes, self.zobristKeys)
+        if self.interning:
+            return self.intern(state)
+        return state
+
+    def makeNextState(self, parent, indexes, changed):
+        """
+        Successor of parent holding indexes, where changed are the
+        fluents added to or removed from parent.  A State gets its
+        hash from the hash of parent and the keys of changed.
+        """
+        if self.stateClass != State:
+            return self.stateClass(indexes)
+        state = State(indexes, self.zobristKeys)
+        if parent.__class__ == State:
+            state.setHash(hash(parent) ^ self.zobristHash(changed))
+        if self.interning:
+            return self.intern(state)
+        return state
+
+    def zobristRandomKey(self):
+        return self.zobristRandom.getrandbits(64) - (1 << 63)
+
+    def zobristHash(self, indexes):
+        "XOR of the keys of fluent indexes"
+        keys = self.zobristKeys
+        h = 0
+        for x in indexes:
+            h ^= keys[x]
+        return h
+
+    def zobristMoveKey(self, r, m):
+        "Key of move index m played by role r"
+        try:
+            return self.zobristMoveKeys[r, m]
+        except KeyError:
+            return self.zobristMoveKeys.setdefault((r, m), self.zobristRandomKey())
+
+    def intern(self, state):
+        """
+        The State equal to state that is shared by every holder
+        of an equal one, so that dictionary lookups succeed on
+        identity before comparing elements.  The table holds
+        States weakly and is keyed by hash; on a hash collision
+        state is returned unshared.
+        """
+        h = hash(state)
+        shared = self.internTable.get(h)
+        if shared is None:
+            self.internTable[h] = state
+            return state
+        if shared == state:
+            return shared
+        return state
+
     def kifTerms(self, state):
         return map(self.stateTerm, state)
 
@@ -282,10 +358,23 @@ class GameDescription:
         except KeyError:
             return self.newStateIndex(self.prologParse(tp), tp)
 
+    def stateValueIndex(self, value):
+        """
+        Index of a state term returned by prolog.runTerms,
+        built without going through the Prolog parser
+        """
+        try:
+            return self.stateValueInv[value]
+        except KeyError:
+            i = self.stateIndex(prologValueStruct(value))
+            self.stateValueInv[value] = i
+            return i
+
     def newStateIndex(self, t, tp):
 	    self.stateTerms.append(t)
             self.statePrologTerms.append(tp)
 	    i = len(self.stateTerms) - 1;
+            self.zobristKeys.append(self.zobristRandomKey())
 	    self.stateTermsInv[t] = i
             self.statePrologTermsInv[tp] = i
             return i
@@ -308,6 +397,14 @@ class GameDescription:
         except KeyError:
             return self.newMoveIndex(self.prologParse(tp), tp)
 
+    def moveValueIndex(self, value):
+        try:
+            return self.moveValueInv[value]
+        except KeyError:
+            i = self.moveIndex(prologValueStruct(value))
+            self.moveValueInv[value] = i
+            return i
+
     def newMoveIndex(self, t, tp):
         self.moveTerms.append(t)
         self.movePrologTerms.append(tp)
@@ -325,17 +422,95 @@ class GameDescription:
 
 
 
+def immutable(self, *args):
+    raise TypeError('States are immutable')
+
 class State(set):
-    def __init__(self, initSet=[]):
+    """
+    Immutable set of fluent indexes hashed by their Zobrist
+    keys
+    """
+    add = discard = remove = pop = clear = immutable
+    update = intersection_update = difference_update = \
+             symmetric_difference_update = immutable
+    __ior__ = __iand__ = __isub__ = __ixor__ = immutable
+
+    def __init__(self, initSet=[], zobristKeys=None):
         set.__init__(self, initSet)
+        self.__keys = zobristKeys
         self.__hash = None
     def __hash__(self):
-        if self.__hash:
-            return self.__hash
-        self.__hash = 1319817
-        for x in self:
-            self.__hash ^= x*(x+1)#id(x)
+        if self.__hash is None:
+            if self.__keys is None:
+                self.__hash = hash(frozenset(self))
+            else:
+                h = 0
+                for x in self:
+                    h ^= self.__keys[x]
+                self.__hash = h
         return self.__hash
+    def setHash(self, h):
+        self.__hash = h
+
+class BitState(object):
+    """
+    Immutable state stored as an int whose set bits are
+    the fluent indexes.  Hashing and equality work on the
+    int directly.
+    """
+    __slots__ = ('bits',)
+
+    def __init__(self, initSet=[]):
+        bits = 0
+        for x in initSet:
+            bits |= 1 << x
+        self.bits = bits
+
+    @staticmethod
+    def fromBits(bits):
+        state = BitState()
+        state.bits = bits
+        return state
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def __eq__(self, other):
+        return other.__class__ == BitState and self.bits == other.bits
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __contains__(self, x):
+        return (self.bits >> x) & 1 == 1
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+    def __iter__(self):
+        bits = self.bits
+        while bits:
+            low = bits & -bits
+            yield low.bit_length() - 1
+            bits ^= low
+
+    def __repr__(self):
+        return 'BitState(' + str(list(self)) + ')'
+
+    def __sub__(self, other):
+        return BitState.fromBits(self.bits & ~BitState.of(other).bits)
+
+    def __and__(self, other):
+        return BitState.fromBits(self.bits & BitState.of(other).bits)
+
+    def __or__(self, other):
+        return BitState.fromBits(self.bits | BitState.of(other).bits)
+
+    @staticmethod
+    def of(state):
+        if state.__class__ == BitState:
+            return state
+        return BitState(state)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,230 @@
+from ggp.kif import Struct, Var, LogicalSentence
+from ggp.util import listMapAdd
+
+# Literal kinds in a normalized rule body
+POSITIVE = 'pos'
+NEGATIVE = 'neg'
+DIFFERENT = 'distinct'
+EQUAL = 'equal'
+
+class Rule:
+    """
+    GDL rule whose body is a flat conjunction of
+    (kind, struct) literals
+    """
+    def __init__(self, head, body):
+        self.head = head
+        self.body = body
+
+    def __repr__(self):
+        return str(self.head) + ' <= ' + str(self.body)
+
+    def literals(self, kind):
+        return [s for k, s in self.body if k == kind]
+
+
+class GroundRule:
+    "Variable-free rule: head <= pos and not neg"
+    def __init__(self, head, pos, neg):
+        self.head = head
+        self.pos = pos
+        self.neg = neg
+
+    def __repr__(self):
+        return str(self.head) + ' <= ' + str(self.pos) + \
+               ' not ' + str(self.neg)
+
+
+def variables(t, acc=None):
+    if acc is None:
+        acc = set()
+    if t.__class__ == Var:
+        acc.add(t)
+    else:
+        for x in t.terms:
+            variables(x, acc)
+    return acc
+
+def substitute(t, bindings):
+    if t.__class__ == Var:
+        return bindings.get(t, t)
+    if len(t.terms) == 0:
+        return t
+    return Struct(t.name, [substitute(x, bindings) for x in t.terms])
+
+def match(pattern, ground, bindings):
+    """
+    Extend bindings so that pattern equals the ground term.
+    Returns None if they do not match.  The bindings passed
+    in are never modified.
+    """
+    if pattern.__class__ == Var:
+        value = bindings.get(pattern)
+        if value is None:
+            bindings = dict(bindings)
+            bindings[pattern] = ground
+            return bindings
+        if value == ground:
+            return bindings
+        return None
+    if pattern.name != ground.name or \
+       len(pattern.terms) != len(ground.terms):
+        return None
+    for p, g in zip(pattern.terms, ground.terms):
+        bindings = match(p, g, bindings)
+        if bindings is None:
+            return None
+    return bindings
+
+def conjunctions(s, positive=True):
+    """
+    Alternative flat bodies for a body sentence, pushing
+    negation down to atoms and splitting disjunctions
+    """
+    if s.__class__ == Struct:
+        if s.name == 'distinct' and s.arity() == 2:
+            return [[(DIFFERENT if positive else EQUAL, s)]]
+        return [[(POSITIVE if positive else NEGATIVE, s)]]
+    if s.op == 'not':
+        return conjunctions(s.sents[0], not positive)
+    if s.op not in ('and', 'or'):
+        raise Exception('Unsupported op in rule body: ' + str(s.op))
+    if (s.op == 'and') == positive:
+        alts = [[]]
+        for x in s.sents:
+            alts = [a + b for a in alts for b in conjunctions(x, positive)]
+        return alts
+    return [a for x in s.sents for a in conjunctions(x, positive)]
+
+def normalize(sent):
+    "Split a GDL sentence into rules with flat bodies"
+    if sent.__class__ == Struct:
+        return [Rule(sent, [])]
+    if sent.op != '<=':
+        raise Exception('Unexpected sentence: ' + str(sent))
+    body = LogicalSentence('and', sent.sents[1:])
+    return [Rule(sent.sents[0], b) for b in conjunctions(body)]
+
+def plan(rule):
+    """
+    Join order for the positive literals of a rule, as a list
+    of (literal, checks) steps.  Every other literal is checked
+    in the first step where it is ground.  The first step has
+    no literal and holds the checks that are ground from the
+    start.
+    """
+    positives = rule.literals(POSITIVE)
+    pending = [(k, s) for k, s in rule.body if k != POSITIVE]
+    bound = set()
+    steps = []
+    for lit in [None] + positives:
+        if lit is not None:
+            variables(lit, bound)
+        ready = [c for c in pending if variables(c[1]) <= bound]
+        pending = [c for c in pending if c not in ready]
+        steps.append((lit, ready))
+    if pending or not variables(rule.head) <= bound:
+        raise Exception('Unsafe rule: ' + str(rule))
+    return steps
+
+def bindings(steps, atoms, negation=False, i=0, b={}):
+    """
+    Bindings that satisfy the steps of a plan, extending b,
+    where atoms maps (name, arity) to the atoms known to hold.
+    With negation, negative literals fail when their atom is
+    known, otherwise they are ignored.
+    """
+    lit, checks = steps[i]
+    if lit is None:
+        candidates = [b]
+    else:
+        candidates = []
+        for atom in atoms.get((lit.name, lit.arity()), ()):
+            b2 = match(lit, atom, b)
+            if b2 is not None:
+                candidates.append(b2)
+    for b2 in candidates:
+        if check(checks, b2, atoms, negation):
+            if i + 1 == len(steps):
+                yield b2
+            else:
+                for b3 in bindings(steps, atoms, negation, i + 1, b2):
+                    yield b3
+
+def check(checks, b, atoms, negation=False):
+    for kind, s in checks:
+        if kind == DIFFERENT:
+            if substitute(s.terms[0], b) == substitute(s.terms[1], b):
+                return False
+        elif kind == EQUAL:
+            if substitute(s.terms[0], b) != substitute(s.terms[1], b):
+                return False
+        elif kind == NEGATIVE and negation:
+            if substitute(s, b) in atoms.get((s.name, s.arity()), ()):
+                return False
+    return True
+
+
+class Grounding:
+    """
+    Instantiates the rules of a game description against the
+    atoms that are reachable when negation is ignored.  Fluents
+    come from init and next, moves come from legal.
+    """
+    def __init__(self, gd):
+        self.gd = gd
+        self.atoms = {}
+        self.rules = []
+        self.plans = []
+        for s in gd.analysis.initRules + gd.analysis.rules:
+            for rule in normalize(s):
+                self.plans.append((rule, plan(rule)))
+        self.saturate()
+        self.instantiate()
+
+    def isKnown(self, atom):
+        return atom in self.atoms.get((atom.name, atom.arity()), ())
+
+    def add(self, atom):
+        key = (atom.name, atom.arity())
+        if key not in self.atoms:
+            self.atoms[key] = set()
+        elif atom in self.atoms[key]:
+            return False
+        self.atoms[key].add(atom)
+        if atom.name == 'init' or atom.name == 'next':
+            self.add(Struct('true', atom.terms))
+        elif atom.name == 'legal':
+            self.add(Struct('does', atom.terms))
+        return True
+
+    def saturate(self):
+        changed = True
+        while changed:
+            changed = False
+            for rule, steps in self.plans:
+                heads = [substitute(rule.head, b) for b in bindings(steps, self.atoms)]
+                for h in heads:
+                    if self.add(h):
+                        changed = True
+
+    def instantiate(self):
+        for rule, steps in self.plans:
+            positives = rule.literals(POSITIVE)
+            negatives = rule.literals(NEGATIVE)
+            for b in bindings(steps, self.atoms):
+                neg = [substitute(n, b) for n in negatives]
+                self.rules.append(GroundRule(substitute(rule.head, b),
+                                             [substitute(p, b) for p in positives],
+                                             [n for n in neg if self.isKnown(n)]))
+
+    def allAtoms(self):
+        for atoms in self.atoms.values():
+            for a in atoms:
+                yield a
+
+    def rulesByHead(self):
+        heads = {}
+        for r in self.rules:
+            listMapAdd(heads, r.head, r)
+        return heads
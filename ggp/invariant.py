@@ -0,0 +1,183 @@
+from ggp.propnet import PropNet, BASE, INPUT, AND, OR, NOT
+
+# Most joint moves to consider one by one, one per bit lane.
+# Beyond that the moves are left unknown.
+MAX_JOINT_MOVES = 1024
+
+class ThreeValued:
+    """
+    Three-valued, bit-parallel evaluation of a propositional
+    network: a component has a mask of lanes where it is surely
+    true and a mask of lanes where it may be true.  A case fixes
+    some base propositions and leaves the others unknown, so
+    whatever holds in every lane holds in every state that
+    matches the case.  Inputs are set from lanes, a map from
+    input component to mask, or unknown if it is empty.
+    """
+    def __init__(self, net):
+        self.net = net
+        self.groups = net.order()
+        self.mask = 1
+        self.lanes = {}
+
+    def evaluate(self, fixed):
+        """
+        Sure and maybe masks of every component when the base
+        propositions in fixed have the given values
+        """
+        net = self.net
+        M = self.mask
+        sure = [0] * net.size()
+        maybe = [0] * net.size()
+        for c, kind in enumerate(net.kinds):
+            if kind == BASE:
+                if c in fixed:
+                    sure[c] = maybe[c] = fixed[c] and M or 0
+                else:
+                    maybe[c] = M
+            elif kind == INPUT:
+                if self.lanes:
+                    sure[c] = maybe[c] = self.lanes.get(c, 0)
+                else:
+                    maybe[c] = M
+        for group in self.groups:
+            if len(group) > 1 or group[0] in net.inputs[group[0]]:
+                # Positive cycle: least fixpoint from false
+                for c in group:
+                    sure[c] = maybe[c] = 0
+                while True:
+                    old = [(sure[c], maybe[c]) for c in group]
+                    for c in group:
+                        self.gate(c, sure, maybe, M)
+                    if old == [(sure[c], maybe[c]) for c in group]:
+                        break
+            else:
+                self.gate(group[0], sure, maybe, M)
+        return sure, maybe
+
+    def gate(self, c, sure, maybe, M):
+        ins = self.net.inputs[c]
+        kind = self.net.kinds[c]
+        if kind == NOT:
+            sure[c] = maybe[ins[0]] ^ M
+            maybe[c] = sure[ins[0]] ^ M
+        elif kind == AND:
+            s = m = M
+            for i in ins:
+                s &= sure[i]
+                m &= maybe[i]
+            sure[c] = s
+            maybe[c] = m
+        elif kind == OR:
+            s = m = 0
+            for i in ins:
+                s |= sure[i]
+                m |= maybe[i]
+            sure[c] = s
+            maybe[c] = m
+
+
+class Invariants(ThreeValued):
+    """
+    Invariants of a game proved by induction over its next
+    rules, on the propositional network.  Each lane of the
+    three-valued evaluation is one joint move.
+
+    latches are the fluents that stay true once true, and
+    negativeLatches those that stay false once false.  mutexes
+    are groups of fluents, sharing a functor and all arguments
+    but one, of which at most one is ever true.  terminalLatches
+    are the latches that make the state terminal on their own.
+    """
+    def __init__(self, gd, net=None):
+        self.gd = gd
+        if net is None:
+            net = PropNet(gd)
+        ThreeValued.__init__(self, net)
+        self.jointMoves()
+
+        self.latches = set()
+        self.negativeLatches = set()
+        self.terminalLatches = set()
+        nexts = dict([(i, c) for c, i in net.nexts])
+        for i, base in net.bases.items():
+            sure, maybe = self.evaluate({base: True})
+            lanes = self.valid(sure, maybe)
+            if i in nexts and sure[nexts[i]] & lanes == lanes:
+                self.latches.add(i)
+                if net.terminal is not None and sure[net.terminal] == self.mask:
+                    self.terminalLatches.add(i)
+            sure, maybe = self.evaluate({base: False})
+            lanes = self.valid(sure, maybe)
+            if i not in nexts or maybe[nexts[i]] & lanes == 0:
+                self.negativeLatches.add(i)
+
+        self.mutexes = []
+        for group in self.candidates():
+            if self.isMutex(group, nexts):
+                self.mutexes.append(group)
+
+    def jointMoves(self):
+        "Lanes: one per joint move if there are few enough"
+        moves = [[] for _ in self.gd.roles]
+        for (r, m), c in self.net.moveInputs.items():
+            moves[r].append(c)
+        count = 1
+        for ms in moves:
+            count *= max(1, len(ms))
+        self.lanes = {}
+        if count > MAX_JOINT_MOVES:
+            self.mask = 1
+            return
+        self.mask = (1 << count) - 1
+        joint = [[]]
+        for ms in moves:
+            joint = [j + [c] for j in joint for c in ms or [None]]
+        for lane, j in enumerate(joint):
+            for c in j:
+                if c is not None:
+                    self.lanes[c] = self.lanes.get(c, 0) | (1 << lane)
+
+    def valid(self, sure, maybe):
+        "Lanes whose joint move may be legal"
+        if not self.lanes:
+            return self.mask
+        lanes = self.mask
+        for r, legals in enumerate(self.net.legals):
+            possible = 0
+            for c, m in legals:
+                i = self.net.moveInputs.get((r, m))
+                if i is not None:
+                    possible |= maybe[c] & self.lanes.get(i, 0)
+            lanes &= possible
+        return lanes
+
+    def candidates(self):
+        "Fluents sharing a functor and all arguments but one"
+        groups = {}
+        for i in self.net.bases:
+            t = self.gd.stateTerm(i)
+            for k in range(t.arity()):
+                key = (t.name, k, tuple(t.terms[:k] + t.terms[k + 1:]))
+                groups.setdefault(key, set()).add(i)
+        results = set()
+        for group in groups.values():
+            if len(group) > 1:
+                results.add(frozenset(group))
+        return sorted(results, key=min)
+
+    def isMutex(self, group, nexts):
+        if len([i for i in self.gd.initialState if i in group]) > 1:
+            return False
+        bases = [self.net.bases[i] for i in group]
+        outputs = [nexts[i] for i in group if i in nexts]
+        for on in bases + [None]:
+            fixed = dict([(b, b == on) for b in bases])
+            sure, maybe = self.evaluate(fixed)
+            lanes = self.valid(sure, maybe)
+            seen = 0
+            for c in outputs:
+                if maybe[c] & seen & lanes:
+                    return False
+                seen |= maybe[c]
+        return True
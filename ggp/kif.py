@@ -4,6 +4,8 @@ import string
 
 GDL_KEYWORDS = set(['role', 'init', 'true', 'next', 'legal', 'does', 'goal', 'terminal', 'distinct'])
 GDL_OPS = set(['not', 'or', 'and', '<='])
+# Keywords whose argument is a fluent
+FLUENT_KEYWORDS = set(['true', 'next'])
 
 class Message:
     def __init__(self, msgType):
@@ -169,11 +171,7 @@ class PrologParser(tpg.Parser):
         return Var(string.lower(string.strip(s)))
 
     def make_const(self,s):
-        name = s.strip()
-        if name[:4] == 'ggp_':
-            return name[4:]
-        else:
-            return name
+        return kifName(s.strip())
         
     def parse(self, start, s):
         try:
@@ -183,6 +181,24 @@ class PrologParser(tpg.Parser):
             raise
 
 
+def kifName(name):
+    "KIF name of a Prolog atom"
+    if name[:4] == 'ggp_':
+        return name[4:]
+    else:
+        return name
+
+def fluentPredicate(keyword, name):
+    "Predicate holding the true or next facts of one fluent functor"
+    return keyword + '_' + name
+
+def prologValueStruct(value):
+    "Struct for a term value returned by pyswipl.runterms"
+    if value.__class__ == tuple:
+        return Struct(kifName(value[0]), [prologValueStruct(v) for v in value[1:]])
+    return Struct(kifName(str(value)), [])
+
+
 class Functor:
     def __init__(self, name, arity):
         self.name = name
@@ -323,12 +339,32 @@ class Struct:
         else:
             return 'ggp_' + self.name
 
-    def prolog(self):
+    def prologValue(self):
+        "Value of the Prolog term, in the form used by pyswipl"
+        if self.arity() == 0:
+            if util.isint(self.name):
+                return int(self.name)
+            return self.prologName()
+        return tuple([self.prologName()] + [t.prologValue() for t in self.terms])
+
+    def prolog(self, fluentPredicates=False):
+        """
+        With fluentPredicates set, true(f(...)) and next(f(...))
+        become true_f(...) and next_f(...)
+        """
         if self.arity() == 0:
             return self.prologName()
         elif self.name == 'distinct':
             return self.terms[0].prolog() + ' \\== ' + \
                    self.terms[1].prolog()
+        elif fluentPredicates and self.name in FLUENT_KEYWORDS and \
+             self.arity() == 1 and self.terms[0].__class__ == Struct:
+            fluent = self.terms[0]
+            name = fluentPredicate(self.name, fluent.name)
+            if fluent.arity() == 0:
+                return name
+            terms = [x.prolog() for x in fluent.terms]
+            return name + '(' + util.join(terms, ',') + ')'
         else:
             terms = [x.prolog() for x in self.terms]
             return self.prologName() + '(' + util.join(terms, ',') + ')'
@@ -355,21 +391,21 @@ class LogicalSentence:
             util.setMapMerge(occur, s.varOccur())
         return occur
 
-    def prolog(self):
-        head = self.sents[0].prolog()
+    def prolog(self, fluentPredicates=False):
+        head = self.sents[0].prolog(fluentPredicates)
         if self.op == '<=':
             if len(self.sents) == 1:
                 return head
             else:
                 cdr = LogicalSentence('and', self.sents[1:])
-                return head + " :- " + cdr.prolog()
+                return head + " :- " + cdr.prolog(fluentPredicates)
         elif self.op == 'not':
             return '\\+ ' + head
         elif self.op == 'or':
-            clauses = [s.prolog() for s in self.sents]
+            clauses = [s.prolog(fluentPredicates) for s in self.sents]
             return '(' + util.join(clauses, ' ; ') + ')'
         elif self.op == 'and':
-            clauses = [s.prolog() for s in self.sents]
+            clauses = [s.prolog(fluentPredicates) for s in self.sents]
             return '(' + util.join(clauses, ',') + ')'
         else:
             raise Exception('Unsupported op: ' + str(self.op))
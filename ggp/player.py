@@ -1,4 +1,5 @@
 import random
+import ggp.util as util
 
 class RandomPlayer:
     """
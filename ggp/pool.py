@@ -0,0 +1,101 @@
+import multiprocessing
+import ggp.util as util
+
+# Game description and simulator of a worker process
+_gd = None
+_sim = None
+
+def _startWorker(text, simName):
+    global _gd, _sim
+    from ggp.gd import GameDescription
+    from ggp.sim import PrologSimulator, simulatorClass
+    _gd = GameDescription()
+    _gd.loadText(text)
+    simClass = simulatorClass(simName)
+    if simClass == PrologSimulator:
+        # A forked worker inherits the Prolog database of its parent
+        PrologSimulator(_gd, assertRules=False).cleanup()
+    _sim = simClass(_gd)
+
+def _workerState(terms):
+    return _gd.makeState([_gd.statePrologIndex(t) for t in terms])
+
+def _nextStates(task):
+    terms, jointMovesList = task
+    state = _workerState(terms)
+    results = []
+    for jointMoves in jointMovesList:
+        moves = [_gd.movePrologIndex(m) for m in jointMoves]
+        next = _sim.computeNextState(state, moves)
+        results.append([_gd.statePrologTerm(i) for i in next])
+    return results
+
+def _legalMoves(states):
+    results = []
+    for terms in states:
+        legal = _sim.computeLegalMoves(_workerState(terms))
+        results.append([[_gd.movePrologTerm(m) for m in moves] for moves in legal])
+    return results
+
+
+class SimulatorPool:
+    """
+    Worker processes that each load the rules of the same game
+    into their own simulator, so that expansions can use every
+    core.  Fluent and move indexes differ between processes, so
+    terms travel in their Prolog form and are mapped back to
+    the indexes of this process's game description.
+    """
+    def __init__(self, gd, processes=None, simName='prolog'):
+        self.gd = gd
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        text = util.join(gd.initRules + gd.rules, '\n')
+        self.pool = multiprocessing.Pool(processes, _startWorker, (text, simName))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def split(self, items):
+        "Split items into one chunk per worker"
+        n = min(self.processes, len(items))
+        return [items[i::n] for i in range(n)]
+
+    def merge(self, chunks, count):
+        "Undo split on the per-chunk results"
+        results = [None] * count
+        n = len(chunks)
+        for i, chunk in enumerate(chunks):
+            results[i::n] = chunk
+        return results
+
+    def prologState(self, state):
+        return [self.gd.statePrologTerm(i) for i in state]
+
+    def computeNextStates(self, state, jointMovesList):
+        """
+        Next state for each joint move, in the same order
+        """
+        if len(jointMovesList) == 0:
+            return []
+        terms = self.prologState(state)
+        tasks = [(terms, [[self.gd.movePrologTerm(m) for m in moves] \
+                          for moves in chunk]) \
+                 for chunk in self.split(list(jointMovesList))]
+        results = self.merge(self.pool.map(_nextStates, tasks), len(jointMovesList))
+        return [self.gd.makeState([self.gd.statePrologIndex(t) for t in r]) \
+                for r in results]
+
+    def computeLegalMovesMany(self, states):
+        """
+        Legal moves of every role for each state, in the same order
+        """
+        if len(states) == 0:
+            return []
+        tasks = [[self.prologState(s) for s in chunk] \
+                 for chunk in self.split(list(states))]
+        results = self.merge(self.pool.map(_legalMoves, tasks), len(states))
+        return [[[self.gd.movePrologIndex(m) for m in moves] for moves in legal] \
+                for legal in results]
@@ -14,3 +14,37 @@ def run(query):
 		solutions.append(bindings)
 	return solutions
 
+def runTerms(query):
+	"Like run, but values are Python terms (see pyswipl.runterms)"
+	return [dict(s) for s in pyswipl.runterms(query)]
+
+class Query:
+	"""
+	Query on a predicate that is looked up once and
+	called with argument terms built directly in C.
+	Arguments follow pyswipl.runterms conventions and
+	None stands for an unbound variable.  Each solution
+	is the tuple of argument values.
+	"""
+	def __init__(self, name, arity):
+		self.predicate = pyswipl.predicate(name, arity)
+
+	def __call__(self, *args):
+		return pyswipl.call(self.predicate, args)
+
+class Engine:
+	"""
+	Prolog engine for a thread other than the main one.
+	A thread attaches an engine before running queries;
+	threads with different engines can query concurrently.
+	Clauses are shared between engines, except for
+	predicates declared thread_local.
+	"""
+	def __init__(self):
+		self.engine = pyswipl.create_engine()
+
+	def attach(self):
+		pyswipl.set_engine(self.engine)
+
+	def detach(self):
+		pyswipl.set_engine(None)
@@ -0,0 +1,473 @@
+import random
+from ggp.ground import Grounding
+from ggp.sim import randomPlayout
+from ggp.util import stronglyConnected
+
+BASE = 'base'
+INPUT = 'input'
+AND = 'and'
+OR = 'or'
+NOT = 'not'
+
+def popCount(x):
+    return bin(x).count('1')
+
+
+class PropNet:
+    """
+    Propositional network compiled from the grounded rules
+    of a game description.  Base propositions hold the true
+    fluents, input propositions the does facts, and every
+    other proposition is an OR over AND gates of its rules.
+
+    Component values are ints used as bit masks, so a value
+    of M (the full mask) is true and 0 is false.
+
+    With invariants set, the optimisation also folds the base
+    propositions that Invariants proves constant in every
+    reachable state: negative latches false in the initial
+    state and latches true in it.  The network is then only
+    correct on reachable states.  terminalLatches holds the
+    fluents that Invariants proves make a state terminal on
+    their own, and is empty without invariants.
+    """
+    def __init__(self, gd, grounding=None, optimize=True, invariants=False):
+        self.gd = gd
+        if grounding is None:
+            grounding = Grounding(gd)
+        self.kinds = []
+        self.inputs = []
+        self.props = {}
+        self.negations = {}
+
+        roles = dict([(r, i) for i, r in enumerate(gd.roles)])
+        self.bases = {}
+        self.moveInputs = {}
+        for atom in grounding.allAtoms():
+            if atom.name == 'true':
+                c = self.add(BASE)
+                self.bases[gd.stateIndex(atom.terms[0])] = c
+            elif atom.name == 'does':
+                c = self.add(INPUT)
+                r = roles[atom.terms[0]]
+                self.moveInputs[(r, gd.moveIndex(atom.terms[1]))] = c
+            else:
+                continue
+            self.props[atom] = c
+
+        heads = grounding.rulesByHead()
+        for head in heads:
+            if head.name != 'init':
+                self.props[head] = self.add(OR)
+        for head, rules in heads.items():
+            if head.name == 'init':
+                continue
+            ors = []
+            for r in rules:
+                ins = [self.props[a] for a in r.pos] + \
+                      [self.negation(a) for a in r.neg]
+                if len(ins) == 1:
+                    ors.append(ins[0])
+                else:
+                    ors.append(self.add(AND, ins))
+            self.inputs[self.props[head]] = ors
+
+        self.legals = [[] for _ in gd.roles]
+        self.goals = [[] for _ in gd.roles]
+        self.nexts = []
+        self.terminal = None
+        for atom, c in self.props.items():
+            if atom.name == 'legal':
+                self.legals[roles[atom.terms[0]]].append(
+                    (c, gd.moveIndex(atom.terms[1])))
+            elif atom.name == 'goal':
+                self.goals[roles[atom.terms[0]]].append(
+                    (c, int(atom.terms[1].name)))
+            elif atom.name == 'next':
+                self.nexts.append((c, gd.stateIndex(atom.terms[0])))
+            elif atom.name == 'terminal' and atom.arity() == 0:
+                self.terminal = c
+        self.gateCounts = (self.gateCount(), self.gateCount())
+        self.terminalLatches = frozenset()
+        if optimize:
+            self.optimize()
+            if invariants:
+                before = self.gateCounts[0]
+                self.optimize(self.constantBases())
+                self.gateCounts = (before, self.gateCount())
+        self.compile()
+
+    def constantBases(self):
+        "Base propositions with the same value in every reachable state"
+        from ggp.invariant import Invariants
+        inv = Invariants(self.gd, self)
+        self.terminalLatches = frozenset(inv.terminalLatches)
+        init = self.gd.initialState
+        constants = {}
+        for i in inv.negativeLatches:
+            if i not in init and i in self.bases:
+                constants[self.bases[i]] = False
+        for i in inv.latches:
+            if i in init and i in self.bases:
+                constants[self.bases[i]] = True
+        return constants
+
+    def add(self, kind, inputs=[]):
+        self.kinds.append(kind)
+        self.inputs.append(list(inputs))
+        return len(self.kinds) - 1
+
+    def negation(self, atom):
+        if atom not in self.negations:
+            self.negations[atom] = self.add(NOT, [self.props[atom]])
+        return self.negations[atom]
+
+    def size(self):
+        return len(self.kinds)
+
+    def gateCount(self):
+        return len([k for k in self.kinds if k != BASE and k != INPUT])
+
+    def optimize(self, constants={}):
+        """
+        Fold constants, merge gates with the same kind and inputs,
+        bypass single-input gates and remove the gates that no
+        output depends on.  constants maps base propositions to
+        values to fold them to.  gateCounts holds the number of
+        gates before and after.
+        """
+        before = self.gateCount()
+        true = self.add(AND)
+        false = self.add(OR)
+        const = {true: True, false: False}
+        rep = range(self.size())
+        for c, value in constants.items():
+            rep[c] = value and true or false
+        seen = {}
+        for group in self.order():
+            c = group[0]
+            if len(group) > 1 or c in self.inputs[c]:
+                for c in group:
+                    self.inputs[c] = [rep[i] for i in self.inputs[c]]
+                continue
+            kind = self.kinds[c]
+            ins = [rep[i] for i in self.inputs[c]]
+            value = None
+            if kind == NOT:
+                if ins[0] in const:
+                    value = not const[ins[0]]
+                elif self.kinds[ins[0]] == NOT:
+                    rep[c] = self.inputs[ins[0]][0]
+                    continue
+            else:
+                # AND is false as soon as one input is, OR true
+                absorbing = kind == OR
+                if absorbing in [const.get(i) for i in ins]:
+                    value = absorbing
+                else:
+                    ins = sorted(set([i for i in ins if i not in const]))
+                    if len(ins) == 0:
+                        value = not absorbing
+                    elif len(ins) == 1:
+                        rep[c] = ins[0]
+                        continue
+            if value is not None:
+                rep[c] = value and true or false
+                continue
+            key = (kind, tuple(ins))
+            if key in seen:
+                rep[c] = seen[key]
+            else:
+                seen[key] = c
+                self.inputs[c] = ins
+
+        self.legals = [[(rep[c], m) for c, m in legals if rep[c] != false] \
+                       for legals in self.legals]
+        self.goals = [[(rep[c], g) for c, g in goals if rep[c] != false] \
+                      for goals in self.goals]
+        self.nexts = [(rep[c], i) for c, i in self.nexts if rep[c] != false]
+        if self.terminal is not None:
+            self.terminal = rep[self.terminal]
+
+        outputs = [c for legals in self.legals for c, m in legals] + \
+                  [c for goals in self.goals for c, g in goals] + \
+                  [c for c, i in self.nexts]
+        if self.terminal is not None:
+            outputs.append(self.terminal)
+        live = set()
+        while outputs:
+            c = outputs.pop()
+            if c not in live:
+                live.add(c)
+                outputs.extend(self.inputs[c])
+        keep = [c for c, k in enumerate(self.kinds) \
+                if c in live or k == BASE or k == INPUT]
+        ids = dict([(c, i) for i, c in enumerate(keep)])
+        self.kinds = [self.kinds[c] for c in keep]
+        self.inputs = [[ids[i] for i in self.inputs[c]] for c in keep]
+        self.props = dict([(a, ids[rep[c]]) for a, c in self.props.items() \
+                           if rep[c] in ids])
+        self.negations = dict([(a, ids[rep[c]]) for a, c in self.negations.items() \
+                               if rep[c] in ids])
+        self.bases = dict([(i, ids[c]) for i, c in self.bases.items()])
+        self.moveInputs = dict([(k, ids[c]) for k, c in self.moveInputs.items()])
+        self.legals = [[(ids[c], m) for c, m in legals] for legals in self.legals]
+        self.goals = [[(ids[c], g) for c, g in goals] for goals in self.goals]
+        self.nexts = [(ids[c], i) for c, i in self.nexts]
+        if self.terminal is not None:
+            self.terminal = ids[self.terminal]
+        self.gateCounts = (before, self.gateCount())
+        return self.gateCounts
+
+    def newValues(self):
+        return [0] * self.size()
+
+    def order(self):
+        """
+        Gate evaluation order as groups of components.  A group
+        with more than one component is a positive cycle.
+        """
+        groups = stronglyConnected(dict(enumerate(self.inputs)))
+        return [g for g in groups \
+                if self.kinds[g[0]] != BASE and self.kinds[g[0]] != INPUT]
+
+    def compile(self):
+        """
+        Generate straight-line propagation functions.  Gates that
+        do not depend on the moves are updated by propagateState,
+        the rest by propagateMoves.
+        """
+        moveDependent = [k == INPUT for k in self.kinds]
+        stateGroups = []
+        moveGroups = []
+        for group in self.order():
+            dependent = False
+            for c in group:
+                for i in self.inputs[c]:
+                    if moveDependent[i]:
+                        dependent = True
+            for c in group:
+                moveDependent[c] = dependent
+            if dependent:
+                moveGroups.append(group)
+            else:
+                stateGroups.append(group)
+        namespace = {}
+        source = self.source('propagateState', stateGroups) + \
+                 self.source('propagateMoves', moveGroups)
+        exec(compile(source, '<propnet>', 'exec'), namespace)
+        self.propagateState = namespace['propagateState']
+        self.propagateMoves = namespace['propagateMoves']
+
+    def expression(self, c):
+        ins = ['v[%d]' % i for i in self.inputs[c]]
+        kind = self.kinds[c]
+        if kind == AND:
+            return ' & '.join(ins) or 'M'
+        elif kind == OR:
+            return ' | '.join(ins) or '0'
+        elif kind == NOT:
+            return ins[0] + ' ^ M'
+        raise Exception('Cannot evaluate component of kind: ' + str(kind))
+
+    def source(self, name, groups):
+        lines = ['def %s(v, M):' % name]
+        for group in groups:
+            c = group[0]
+            if len(group) == 1 and c not in self.inputs[c]:
+                lines.append('    v[%d] = %s' % (c, self.expression(c)))
+                continue
+            # Positive cycle: iterate up to the least fixpoint
+            for c in group:
+                if self.kinds[c] == NOT:
+                    raise Exception('Rules are not stratified')
+                lines.append('    v[%d] = 0' % c)
+            values = '(' + ', '.join(['v[%d]' % c for c in group]) + ',)'
+            lines.append('    while True:')
+            lines.append('        old = ' + values)
+            for c in group:
+                lines.append('        v[%d] = %s' % (c, self.expression(c)))
+            lines.append('        if ' + values + ' == old: break')
+        lines.append('    pass')
+        return '\n'.join(lines) + '\n'
+
+
+class PropNetSimulator:
+    """
+    Simulator that evaluates a propositional network instead
+    of querying Prolog.  Same interface as PrologSimulator.
+    invariants is passed on to PropNet.
+    """
+    def __init__(self, gd, invariants=False):
+        self.gd = gd
+        self.net = PropNet(gd, invariants=invariants)
+        self.nextFluents = set([i for c, i in self.net.nexts])
+        self.values = self.net.newValues()
+        self.state = None
+        self.moves = []
+
+    def cleanup(self):
+        pass
+
+    def assertTrue(self, state):
+        if self.state != state:
+            self.state = state
+            v = self.values
+            for c in self.net.bases.values():
+                v[c] = 0
+            bases = self.net.bases
+            for i in state:
+                if i in bases:
+                    v[bases[i]] = 1
+            self.net.propagateState(v, 1)
+
+    def assertDoes(self, moves):
+        v = self.values
+        for c in self.moves:
+            v[c] = 0
+        self.moves = []
+        for r, m in enumerate(moves):
+            c = self.net.moveInputs.get((r, m))
+            if c is not None:
+                v[c] = 1
+                self.moves.append(c)
+        self.net.propagateMoves(v, 1)
+
+    def isTerminal(self, state):
+        # A terminal latch decides without evaluating the network
+        if not self.net.terminalLatches.isdisjoint(state):
+            return True
+        self.assertTrue(state)
+        if self.net.terminal is None:
+            return False
+        return self.values[self.net.terminal] != 0
+
+    def computeGoals(self, state):
+        self.assertTrue(state)
+        v = self.values
+        results = []
+        for r, goals in enumerate(self.net.goals):
+            values = [g for c, g in goals if v[c]]
+            if len(values) == 0:
+                raise Exception('No goal value for role: ' + \
+                                str(self.gd.roleTerm(r)))
+            results.append(values[0])
+        return results
+
+    def computeLegalMoves(self, state):
+        self.assertTrue(state)
+        v = self.values
+        return [[m for c, m in legals if v[c]] for legals in self.net.legals]
+
+    def computeNextState(self, state, moves):
+        """
+        The fluents whose next component differs from their base
+        value are the ones that change, so the successor's hash is
+        updated from those alone
+        """
+        self.assertTrue(state)
+        self.assertDoes(moves)
+        v = self.values
+        indexes = []
+        changed = []
+        found = 0
+        for c, i in self.net.nexts:
+            if i in state:
+                found += 1
+                if v[c]:
+                    indexes.append(i)
+                else:
+                    changed.append(i)
+            elif v[c]:
+                indexes.append(i)
+                changed.append(i)
+        if found != len(state):
+            # Fluents of state without a next component are dropped
+            changed.extend([i for i in state if i not in self.nextFluents])
+        return self.gd.makeNextState(state, indexes, changed)
+
+    def computeAllNextStates(self, state, jointMovesList):
+        return [self.computeNextState(state, moves) for moves in jointMovesList]
+
+    def playout(self, state, seed, policy='random', recordMoves=False):
+        return randomPlayout(self, state, seed, policy, recordMoves)
+
+    def parallelPlayouts(self, state, seed, lanes=64):
+        """
+        Run one random playout per bit of the component values,
+        all from state and in lockstep through the network.
+        Lanes that reach a terminal state are scored and then
+        ignored.  Returns the mean goal value of each role and
+        the mean depth.
+        """
+        net = self.net
+        rng = random.Random(seed)
+        M = (1 << lanes) - 1
+        v = net.newValues()
+        for i in state:
+            if i in net.bases:
+                v[net.bases[i]] = M
+        nexts = [(c, net.bases[i]) for c, i in net.nexts]
+        inputs = net.moveInputs.values()
+        goalSums = [0] * len(self.gd.roles)
+        depthSum = 0
+        active = M
+        depth = 0
+        while True:
+            net.propagateState(v, M)
+            if net.terminal is None:
+                done = 0
+            else:
+                done = v[net.terminal] & active
+            if done:
+                n = popCount(done)
+                depthSum += n * depth
+                for r, goals in enumerate(net.goals):
+                    left = done
+                    for c, g in goals:
+                        hit = v[c] & left
+                        if hit:
+                            goalSums[r] += g * popCount(hit)
+                            left &= ~hit
+                    if left:
+                        raise Exception('No goal value for role: ' + \
+                                        str(self.gd.roleTerm(r)))
+                active &= ~done
+            if active == 0:
+                break
+            for c in inputs:
+                v[c] = 0
+            for r, legals in enumerate(net.legals):
+                self.chooseMoves(v, r, legals, active, rng)
+            net.propagateMoves(v, M)
+            values = [v[c] for c, b in nexts]
+            for c in net.bases.values():
+                v[c] = 0
+            for (c, b), x in zip(nexts, values):
+                v[b] |= x
+            depth += 1
+        # The simulator's cached state is gone
+        self.state = None
+        self.moves = []
+        return [float(g) / lanes for g in goalSums], float(depthSum) / lanes
+
+    def chooseMoves(self, v, r, legals, active, rng):
+        """
+        Set the input of a uniformly random legal move of role r
+        in each active lane
+        """
+        legal = [(self.net.moveInputs[(r, m)], v[c] & active) for c, m in legals]
+        legal = [(c, x) for c, x in legal if x]
+        if len(legal) == 1 and legal[0][1] == active:
+            v[legal[0][0]] = active
+            return
+        choices = {}
+        for c, x in legal:
+            while x:
+                low = x & -x
+                choices.setdefault(low, []).append(c)
+                x ^= low
+        if popCount(active) != len(choices):
+            raise Exception('Playout reached a state without legal moves')
+        for low, cs in choices.iteritems():
+            v[rng.choice(cs)] |= low
@@ -0,0 +1,228 @@
+import heapq
+from ggp.ground import Grounding
+from ggp.sim import randomPlayout
+from ggp.util import stronglyConnected
+
+class GroundReasoner:
+    """
+    Stratified forward chaining over the grounded rules of a
+    game description.  Every ground atom gets an integer id;
+    each rule keeps a counter of positive body atoms not yet
+    derived and fires once the counter reaches zero and the
+    stratum of its head is reached, so that negated atoms
+    (always in lower strata) are final.
+
+    Evaluation is split in two phases.  The state phase
+    derives every atom that does not depend on does facts
+    and is run once per state.  The move phase continues
+    from a copy of it with the does facts added.
+    """
+    def __init__(self, gd, grounding=None):
+        self.gd = gd
+        if grounding is None:
+            grounding = Grounding(gd)
+        self.atoms = {}
+        self.atomTerms = []
+        roles = dict([(r, i) for i, r in enumerate(gd.roles)])
+
+        self.heads = []
+        self.negs = []
+        self.counts = []
+        self.triggers = []
+        for r in grounding.rules:
+            if r.head.name == 'init':
+                continue
+            self.heads.append(self.atomId(r.head))
+            self.negs.append([self.atomId(a) for a in r.neg])
+            pos = set([self.atomId(a) for a in r.pos])
+            self.counts.append(len(pos))
+            for a in pos:
+                self.triggers[a].append(len(self.heads) - 1)
+
+        self.fluents = {}
+        self.moveAtoms = {}
+        self.legals = [[] for _ in gd.roles]
+        self.goals = [[] for _ in gd.roles]
+        self.nexts = []
+        self.terminal = None
+        for a, t in enumerate(self.atomTerms):
+            if t.name == 'true':
+                self.fluents[gd.stateIndex(t.terms[0])] = a
+            elif t.name == 'does':
+                self.moveAtoms[(roles[t.terms[0]], gd.moveIndex(t.terms[1]))] = a
+            elif t.name == 'legal':
+                self.legals[roles[t.terms[0]]].append((a, gd.moveIndex(t.terms[1])))
+            elif t.name == 'goal':
+                self.goals[roles[t.terms[0]]].append((a, int(t.terms[1].name)))
+            elif t.name == 'next':
+                self.nexts.append((a, gd.stateIndex(t.terms[0])))
+            elif t.name == 'terminal' and t.arity() == 0:
+                self.terminal = a
+        self.stratify()
+
+    def atomId(self, atom):
+        try:
+            return self.atoms[atom]
+        except KeyError:
+            self.atoms[atom] = len(self.atomTerms)
+            self.atomTerms.append(atom)
+            self.triggers.append([])
+            return self.atoms[atom]
+
+    def stratify(self):
+        graph = dict([(a, set()) for a in range(len(self.atomTerms))])
+        for r, h in enumerate(self.heads):
+            graph[h].update(self.negs[r])
+        for a, rules in enumerate(self.triggers):
+            for r in rules:
+                graph[self.heads[r]].add(a)
+        components = stronglyConnected(graph)
+        self.strata = [0] * len(self.atomTerms)
+        for s, component in enumerate(components):
+            for a in component:
+                self.strata[a] = s
+        for r, h in enumerate(self.heads):
+            for n in self.negs[r]:
+                if self.strata[n] == self.strata[h]:
+                    raise Exception('Rules are not stratified: ' + \
+                                    str(self.atomTerms[h]))
+
+        moveDependent = [t.name == 'does' for t in self.atomTerms]
+        for component in components:
+            dependent = False
+            for a in component:
+                for b in graph[a]:
+                    if moveDependent[b]:
+                        dependent = True
+            for a in component:
+                moveDependent[a] = dependent
+        self.moveDependent = [moveDependent[h] for h in self.heads]
+
+    def derive(self, holds, counts, agenda, delayed):
+        """
+        Run the agenda of (stratum, rule) pairs to completion.
+        Rules with move-dependent heads go to delayed when
+        given, instead of firing.
+        """
+        heads = self.heads
+        negs = self.negs
+        triggers = self.triggers
+        while agenda:
+            _, r = heapq.heappop(agenda)
+            h = heads[r]
+            if holds[h]:
+                continue
+            blocked = False
+            for n in negs[r]:
+                if holds[n]:
+                    blocked = True
+                    break
+            if blocked:
+                continue
+            holds[h] = 1
+            for r2 in triggers[h]:
+                counts[r2] -= 1
+                if counts[r2] == 0:
+                    self.schedule(r2, agenda, delayed)
+
+    def schedule(self, r, agenda, delayed):
+        if delayed is not None and self.moveDependent[r]:
+            delayed.append(r)
+        else:
+            heapq.heappush(agenda, (self.strata[self.heads[r]], r))
+
+    def add(self, a, holds, counts, agenda, delayed):
+        if not holds[a]:
+            holds[a] = 1
+            for r in self.triggers[a]:
+                counts[r] -= 1
+                if counts[r] == 0:
+                    self.schedule(r, agenda, delayed)
+
+    def evaluateState(self, state):
+        """
+        Derive every state-dependent atom.  Returns the values,
+        counters and delayed rules that evaluateMoves needs.
+        """
+        holds = bytearray(len(self.atomTerms))
+        counts = list(self.counts)
+        agenda = []
+        delayed = []
+        for r, c in enumerate(counts):
+            if c == 0:
+                self.schedule(r, agenda, delayed)
+        fluents = self.fluents
+        for i in state:
+            if i in fluents:
+                self.add(fluents[i], holds, counts, agenda, delayed)
+        self.derive(holds, counts, agenda, delayed)
+        return holds, counts, delayed
+
+    def evaluateMoves(self, evaluation, moves):
+        holds, counts, delayed = evaluation
+        holds = bytearray(holds)
+        counts = list(counts)
+        agenda = []
+        for r in delayed:
+            self.schedule(r, agenda, None)
+        for r, m in enumerate(moves):
+            a = self.moveAtoms.get((r, m))
+            if a is not None:
+                self.add(a, holds, counts, agenda, None)
+        self.derive(holds, counts, agenda, None)
+        return holds
+
+
+class ReasonerSimulator:
+    """
+    Simulator backed by the pure Python GroundReasoner.
+    Same interface as PrologSimulator.
+    """
+    def __init__(self, gd):
+        self.gd = gd
+        self.reasoner = GroundReasoner(gd)
+        self.state = None
+        self.evaluation = None
+
+    def cleanup(self):
+        pass
+
+    def assertTrue(self, state):
+        if self.state != state:
+            self.state = state
+            self.evaluation = self.reasoner.evaluateState(state)
+
+    def isTerminal(self, state):
+        self.assertTrue(state)
+        if self.reasoner.terminal is None:
+            return False
+        return self.evaluation[0][self.reasoner.terminal] != 0
+
+    def computeGoals(self, state):
+        self.assertTrue(state)
+        holds = self.evaluation[0]
+        results = []
+        for r, goals in enumerate(self.reasoner.goals):
+            values = [g for a, g in goals if holds[a]]
+            if len(values) == 0:
+                raise Exception('No goal value for role: ' + \
+                                str(self.gd.roleTerm(r)))
+            results.append(values[0])
+        return results
+
+    def computeLegalMoves(self, state):
+        self.assertTrue(state)
+        holds = self.evaluation[0]
+        return [[m for a, m in legals if holds[a]] \
+                for legals in self.reasoner.legals]
+
+    def computeNextState(self, state, moves):
+        self.assertTrue(state)
+        holds = self.reasoner.evaluateMoves(self.evaluation, moves)
+        return self.gd.makeState([i for a, i in self.reasoner.nexts if holds[a]])
+
+    def computeAllNextStates(self, state, jointMovesList):
+        return [self.computeNextState(state, moves) for moves in jointMovesList]
+
+    def playout(self, state, seed, policy='random', recordMoves=False):
+        return randomPlayout(self, state, seed, policy, recordMoves)
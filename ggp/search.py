@@ -1,6 +1,7 @@
+import sys
 import time
 from ggp.util import shuffle
-from ggp.cache import FIFOCache
+from ggp.cache import ClockCache
 
 class VF:
     """
@@ -61,20 +62,49 @@ class Search:
             self.value = value
             self.bestMove = bestMove
 
-    def __init__(self, gd, sim, role, shouldIStop, reportAnswer):
+    def __init__(self, gd, sim, role, shouldIStop, reportAnswer, symmetries=None):
         self.gd = gd
         self.sim = sim
         self.role = role
         self.shouldIStop = shouldIStop
         self.reportAnswer = reportAnswer
+        self.symmetries = symmetries
+        self.ttCapacity = 64 * 1024 * 1024
         self.tt = None
 
+    def ttLookup(self, state):
+        """
+        Transposition table entry of state or None.  With
+        symmetries the table is keyed on canonical states and
+        best moves are mapped back to the frame of state.
+        """
+        k = None
+        if self.symmetries is not None:
+            state, k = self.symmetries.canonical(state)
+        entry = self.tt.get(state)
+        if entry is None or k is None or entry.bestMove == -1:
+            return entry
+        return self.TranspositionEntry(entry.depth, entry.flags, entry.value,
+                                       self.symmetries.mapMove(entry.bestMove, k, True))
+
+    def entrySize(self, state, entry):
+        "Estimated bytes of a transposition table entry"
+        return sys.getsizeof(state) + sys.getsizeof(entry) + \
+               sys.getsizeof(entry.__dict__) + sys.getsizeof(entry.value)
+
+    def ttStore(self, state, entry):
+        if self.symmetries is not None:
+            state, k = self.symmetries.canonical(state)
+            if k is not None and entry.bestMove != -1:
+                entry.bestMove = self.symmetries.mapMove(entry.bestMove, k)
+        self.tt[state] = entry
+
     def search(self, state, heuristic = None, removeStep=False, maxDepth = -1, maxOppMoves = -1):
         self.heuristic = heuristic
         self.deepenForced = False
         if self.role == 0:
             self.deepenForced = True
-        self.tt = FIFOCache() #{} 
+        self.tt = ClockCache(self.ttCapacity, self.entrySize)
         self.maxOppMoves = maxOppMoves
         if heuristic == None:
             self.topLevelSearch(state, -1)
@@ -115,10 +145,11 @@ class Search:
 	# Check to see if this state is in 
 	# the transposition table.  It should be
 	# if it's our turn.
-        if state in self.tt:
+        entry = self.ttLookup(state)
+        if entry is not None:
 	    # If the state is in the TT then use the entries
 	    # best move as the current best move
-	    bestMove = self.tt[state].bestMove
+	    bestMove = entry.bestMove
 	if bestMove == -1 or \
            self.role not in self.gd.turnTakers(legalMoves):
 	    # If the state is NOT in the TT
@@ -152,8 +183,8 @@ class Search:
 	
 	# Check if this is state is already in the
 	# transposition table
-        if state in self.tt:
-            entry = self.tt[state]
+        entry = self.ttLookup(state)
+        if entry is not None:
             if entry.depth >= depth:
                 if entry.flags == 'e':
 		    return entry.value
@@ -176,7 +207,7 @@ class Search:
                 features = None
 	    value = VF((goals[self.role], features))
 	    # Put state in transposition table
-	    self.tt[state] = self.TranspositionEntry(depth, 'e', value, bestMove)
+	    self.ttStore(state, self.TranspositionEntry(depth, 'e', value, bestMove))
 	    return value
 
 	############################
@@ -188,7 +219,7 @@ class Search:
             #if value <= 0 or value >= 100:
             #    raise Exception('bad value: %d' % value)
 	    # Put state in transposition table
-	    self.tt[state] = self.TranspositionEntry(depth, 'e', value, bestMove)
+	    self.ttStore(state, self.TranspositionEntry(depth, 'e', value, bestMove))
 	    return value
 
         # Get legal moves
@@ -245,28 +276,40 @@ class Search:
                                  alpha, beta, turnTaker, moveList)
     
 
+    def children(self, state, legalMoves, turnTaker, moveList, depth):
+        """
+        (move, next state) for each move of the turn taker, in
+        order, with every other player making its last listed
+        legal move.  Next states are computed as they are
+        needed, so that a cutoff skips the remaining siblings,
+        except just above the search frontier where all of them
+        are computed in one call.
+        """
+        jointMovesList = []
+        for move in moveList:
+            moves = [list(x).pop() for x in legalMoves]
+            moves[turnTaker] = move
+            jointMovesList.append(moves)
+        if depth == 1:
+            return zip(moveList, self.sim.computeAllNextStates(state, jointMovesList))
+        return ((move, self.sim.computeNextState(state, moves)) \
+                for move, moves in zip(moveList, jointMovesList))
+
     # Handle MAX node
     def maximize(self, state, legalMoves, bestMove, depth, 
                  alpha, beta, turnTaker, moveList):
 	flags = 'a'
 	    
 	# Iterate through moves
-        for move in moveList:
-	    # Create move vector for all players
-	    moves = [list(x).pop() for x in legalMoves]
-            moves[turnTaker] = move
-
-	    # Make move
-	    nextState = self.sim.computeNextState(state, moves)
-            if self.shouldIStop(): return None
-	    
+        for move, nextState in self.children(state, legalMoves, turnTaker,
+                                             moveList, depth):
 	    # Expand child node
 	    value = self.alphaBeta(nextState, depth - 1, alpha, beta)
             if self.shouldIStop(): return None
 	    
 	    # Check for beta cutoff
             if value >= beta:
-		self.tt[state] = self.TranspositionEntry(depth, 'b', beta, move)
+		self.ttStore(state, self.TranspositionEntry(depth, 'b', beta, move))
 		return beta
 
 	    # Check if this is best move
@@ -276,7 +319,7 @@ class Search:
 		flags = 'e'
 
         # No better move found, return alpha
-	self.tt[state] = self.TranspositionEntry(depth, flags, alpha, bestMove)
+	self.ttStore(state, self.TranspositionEntry(depth, flags, alpha, bestMove))
 	return alpha
 
 
@@ -285,28 +328,21 @@ class Search:
                  alpha, beta, turnTaker, moveList):
 	flags = 'b'
 	
-	# Iterate through moves
-        for moveNum, move in enumerate(moveList):
-            # If we've reached the maximum number of opponent moves to
-            # explore then just move on
-            if moveNum == self.maxOppMoves:
-                break
-            
-	    # Create move vector for all players
-	    moves = [list(x).pop() for x in legalMoves]
-            moves[turnTaker] = move
+        # If there is a maximum number of opponent moves to
+        # explore then ignore the rest
+        if self.maxOppMoves >= 0:
+            moveList = moveList[:self.maxOppMoves]
 
-	    # Make move
-	    nextState = self.sim.computeNextState(state, moves)
-            if self.shouldIStop(): return None
-	    
+	# Iterate through moves
+        for move, nextState in self.children(state, legalMoves, turnTaker,
+                                             moveList, depth):
 	    # Expand child node
 	    value = self.alphaBeta(nextState, depth - 1, alpha, beta)
             if self.shouldIStop(): return None
 	    
 	    # Check for alpha cutoff
             if value <= alpha:
-		self.tt[state] = self.TranspositionEntry(depth, 'a', alpha, move)
+		self.ttStore(state, self.TranspositionEntry(depth, 'a', alpha, move))
 		return alpha
 
             # Check if this is the best move
@@ -316,7 +352,7 @@ class Search:
 		flags = 'e'
 
         # No better move found, return beta
-	self.tt[state] = self.TranspositionEntry(depth, flags, beta, bestMove)
+	self.ttStore(state, self.TranspositionEntry(depth, flags, beta, bestMove))
 	return beta
 
     
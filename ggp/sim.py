@@ -1,21 +1,158 @@
+import random
+import sys
 from ggp.kif import *
 from ggp.gd import *
+import ggp.util as util
 
 COMPILED_PREDS = [ROLE, NEXT, LEGAL, GOAL, TERMINAL]
 
+# Helper predicate for computeAllNextStates: for each list of does
+# facts in Ms, replace does/2 with it and collect the next fluents.
+# The %s slot takes goals to run after each change of does/2.
+ALL_NEXT_RULE = "(all_next(Ms, Ns) :- findall(Xs, (member(Ds, Ms), " + \
+                "retractall(does(_, _)), forall(member(D, Ds), assert(D)), %s" + \
+                "findall(X, next(X), Xs)), Ns))"
+
+# Helper predicates for playout.  playout(Roles, Seed, Depth, Goals,
+# Moves) plays uniformly random legal moves from the asserted state
+# until it is terminal.  Moves gets the move of each role, in the
+# order of Roles, for every step.  STATE_RESET and MOVES_RESET take
+# goals to run after each change of the state and of does/2.
+PLAYOUT_RULES = [
+    "(playout(Roles, Seed, Depth, Goals, Moves) :- " + \
+    "set_random(seed(Seed)), playout_loop(Roles, 0, Depth, Moves, Goals))",
+    "(playout_loop(_, D, D, [], Goals) :- terminal, !, " + \
+    "findall(R-G, goal(R, G), Goals))",
+    "(playout_loop(Roles, D0, D, [Ms|Rest], Goals) :- " + \
+    "findall(does(R, M), (member(R, Roles), findall(M0, legal(R, M0), L0), " + \
+    "sort(L0, L), random_member(M, L)), Ds), length(Roles, N), length(Ds, N), " + \
+    "findall(M, member(does(_, M), Ds), Ms), " + \
+    "retractall(does(_, _)), forall(member(X, Ds), assert(X)), MOVES_RESET" + \
+    "findall(F, next(F), Fs0), sort(Fs0, Fs), " + \
+    "clear_true, forall(member(F, Fs), assert_true(F)), STATE_RESET" + \
+    "D1 is D0 + 1, playout_loop(Roles, D1, D, Rest, Goals))",
+]
+
 class PrologSimulator:
-    import ggp.prolog as prolog
+    """
+    Simulator that asserts the game rules into SWI-Prolog.
+
+    With fluentPredicates set, each fluent functor gets its own
+    true_f and next_f predicates (see Struct.prolog) so that
+    clause indexing works on the fluent arguments.  true/1 and
+    next/1 are kept as rules on top of them.  Games with
+    variable fluents in true or next literals use true/1.
 
-    def __init__(self, gd):
+    With tabling set, the recursive relations are tabled and
+    the tables are dropped whenever the state changes, or the
+    moves if a tabled relation depends on them.
+
+    With threadLocal set, the true predicates and does/2 are
+    thread_local so that each thread, running on its own
+    prolog.Engine, keeps its own state.  The rules are shared
+    between engines: simulators created after the first one
+    for the same game should pass assertRules=False.
+
+    With turnTaking set, control fluents found by TurnTaking
+    give the only move of idle roles, and legal/2 is only
+    queried for the other roles.
+    """
+    def __init__(self, gd, incremental=True, threadLocal=False, assertRules=True,
+                 fluentPredicates=True, tabling=False, turnTaking=False):
+        import ggp.prolog as prolog
+        self.prolog = prolog
         self.parser = KIFParser()
         self.state = None
         self.moves = None
+        self.incremental = incremental
+        self.threadLocal = threadLocal
         self.gd = gd
-        for r in self.gd.rules:
-            self.assertRule(r)
+        self.fluentPredicates = fluentPredicates and not gd.analysis.variableFluents
+        self.trueGoals = {}
+        self.tabled = []
+        if tabling:
+            self.tabled = [Functor(name, arity).prolog() \
+                           for name, arity in gd.analysis.recursive()]
+        self.tableMoves = len(self.tabled) > 0 and \
+                          gd.analysis.dependsOn(gd.analysis.recursive(), ('does', 2))
+        self.roleIndex = dict([(r.prolog(), i) for i, r in enumerate(gd.roles)])
+        self.turns = None
+        if turnTaking:
+            from ggp.turns import TurnTaking
+            self.turns = TurnTaking(gd)
+        self.terminalQuery = prolog.Query('terminal', 0)
+        self.goalQuery = prolog.Query('goal', 2)
+        self.legalQuery = prolog.Query('legal', 2)
+        self.nextQuery = prolog.Query('next', 1)
+        self.allNextQuery = prolog.Query('all_next', 2)
+        self.playoutQuery = prolog.Query('playout', 5)
+        self.moveValues = {}
+        if threadLocal:
+            preds = self.statePredicates('true') + ['does/2']
+            self.prolog.run(util.join(['thread_local(' + p + ')' for p in preds], ', ') + '.')
+        if assertRules:
+            # Relations left without clauses by the analysis must
+            # still fail rather than raise an existence error.
+            # Tabled relations always have clauses.
+            preds = [f.prolog() for f in self.gd.relations \
+                     if f.prolog() not in self.tabled]
+            if self.fluentPredicates:
+                if not threadLocal:
+                    preds.extend(self.statePredicates('true'))
+                preds.extend(self.statePredicates('next'))
+            for p in preds:
+                self.prolog.run('dynamic(' + p + ').')
+            for p in self.tabled:
+                self.prolog.run('table(' + p + ').')
+            if self.fluentPredicates:
+                self.assertFluentRules()
+            for r in self.gd.analysis.rules:
+                self.assertRule(r)
+            self.prolog.run('assert(' + (ALL_NEXT_RULE % self.movesReset()) + ').')
+            self.assertPlayoutRules()
 
     def assertRule(self, rule):
-        self.prolog.run('assert((' + rule.prolog() + ')).')
+        self.prolog.run('assert((' + rule.prolog(self.fluentPredicates) + ')).')
+
+    def assertFluentRules(self):
+        "true/1 and next/1 on top of the per-functor predicates"
+        for f in self.gd.stateVars:
+            fluent = Struct(f.name, [Var('a' + str(i)) for i in range(f.arity)])
+            for keyword in FLUENT_KEYWORDS:
+                lit = Struct(keyword, [fluent])
+                self.prolog.run('assert((' + lit.prolog() + ' :- ' + lit.prolog(True) + ')).')
+
+    def assertPlayoutRules(self):
+        "Prolog side of playout, see PLAYOUT_RULES"
+        if self.fluentPredicates:
+            for f in self.gd.stateVars:
+                fluent = Struct(f.name, [Var('a' + str(i)) for i in range(f.arity)])
+                self.prolog.run('assert((assert_true(' + fluent.prolog() + ') :- assert(' + \
+                                Struct('true', [fluent]).prolog(True) + '))).')
+        else:
+            self.prolog.run('assert((assert_true(X) :- assert(true(X)))).')
+        goals = [self.retractAllGoal(p) for p in self.statePredicates('true')]
+        self.prolog.run('assert((clear_true :- ' + util.join(goals, ', ') + ')).')
+        stateReset = ''
+        if len(self.tabled) > 0:
+            stateReset = 'abolish_all_tables, '
+        for rule in PLAYOUT_RULES:
+            rule = rule.replace('MOVES_RESET', self.movesReset())
+            rule = rule.replace('STATE_RESET', stateReset)
+            self.prolog.run('assert(' + rule + ').')
+
+    def movesReset(self):
+        "Goals to run in helper predicates after a change of does/2"
+        if self.tableMoves:
+            return 'abolish_all_tables, '
+        return ''
+
+    def statePredicates(self, keyword):
+        "Predicates holding the true or next facts, as name/arity"
+        if not self.fluentPredicates:
+            return [keyword + '/1']
+        return [fluentPredicate(keyword, f.name) + '/' + str(f.arity) \
+                for f in self.gd.stateVars]
 
     def abolishFunctor(self, func):
         self.prolog.run('abolish(' + str(func) + ').')
@@ -23,64 +160,218 @@ class PrologSimulator:
     def cleanup(self):
         funcs = list(self.gd.relations)
         funcs.extend(COMPILED_PREDS)
+        if len(self.tabled) > 0:
+            self.prolog.run('abolish_all_tables.')
         for func in funcs:
             self.abolishFunctor(func.prolog())
+        for pred in ['all_next/2', 'playout/5', 'playout_loop/5',
+                     'assert_true/1', 'clear_true/0']:
+            self.abolishFunctor(pred)
+        if self.fluentPredicates:
+            for pred in self.statePredicates('true') + self.statePredicates('next'):
+                self.abolishFunctor(pred)
+            self.abolishFunctor('true/1')
 
     def assertTrue(self, state):
         if self.state != state:
-            self.prolog.run("abolish(true/1).")
-            self.state = state
-            terms = [self.gd.statePrologTerm(i) for i in state]
-            if len(terms) == 0:
+            if len(state) == 0:
                 raise Exception('Encountered empty state in assertTrue')
-            for t in terms:
-                self.prolog.run("assert(true(" + t + ")).")
+            goals = None
+            if self.incremental and self.state is not None:
+                # Only retract and assert the fluents that changed
+                goals = ["retract(" + self.trueGoal(i) + ")" \
+                         for i in self.state if i not in state]
+                goals.extend(["assert(" + self.trueGoal(i) + ")" \
+                              for i in state if i not in self.state])
+            self.state = None
+            self.update(goals, lambda: self.fullTrueGoals(state), len(self.tabled) > 0)
+            self.state = state
+
+    def fullTrueGoals(self, state):
+        "Goals that clear the true predicates and assert state"
+        full = [self.clearGoal(p) for p in self.statePredicates('true')]
+        full.extend(["assert(" + self.trueGoal(i) + ")" for i in state])
+        return full
 
     def assertDoes(self, moves):
-        #gjk
-        if True:#self.moves != moves:
-            self.moves = moves
-            self.prolog.run("abolish(does/2).")
-            terms = [self.gd.movePrologTerm(i) for i in moves]
-            if len(terms) == 0:
+        if self.moves != moves:
+            if len(moves) == 0:
                 raise Exception('Encountered empty move set in assertDoes')
-            for i, t in enumerate(terms):
-                role = self.gd.roleTerm(i)
-                self.prolog.run("assert(does(" + role.prolog() + \
-                           ", " + t + ")).")
+            goals = None
+            if self.incremental and self.moves is not None:
+                changed = [i for i, m in enumerate(moves) if self.moves[i] != m]
+                goals = [self.doesTerm(i, self.moves[i], "retract") for i in changed]
+                goals.extend([self.doesTerm(i, moves[i], "assert") for i in changed])
+            self.moves = None
+            self.update(goals, lambda: self.fullDoesGoals(moves), self.tableMoves)
+            # Keep a copy, callers may reuse their move list
+            self.moves = list(moves)
+
+    def fullDoesGoals(self, moves):
+        "Goals that clear does/2 and assert moves"
+        full = [self.clearGoal("does/2")]
+        full.extend([self.doesTerm(i, m, "assert") for i, m in enumerate(moves)])
+        return full
+
+    def update(self, goals, full, resetTables):
+        """
+        Run goals, the changes to the database, or when goals is
+        None the goals returned by full(), which clear and
+        reassert everything.  If the changes fail, which leaves
+        the database out of step with the recorded state or
+        moves, fall back to full().  The caller clears its record
+        first so that it stays cleared if that fails too.  With
+        resetTables, tabled answers are abolished afterwards.
+        """
+        if goals is not None:
+            if len(goals) == 0:
+                return
+            if resetTables:
+                goals.append("abolish_all_tables")
+            if len(self.prolog.run(util.join(goals, ', ') + ".")) > 0:
+                return
+        full = full()
+        if resetTables:
+            full.append("abolish_all_tables")
+        if len(self.prolog.run(util.join(full, ', ') + ".")) == 0:
+            raise Exception('Prolog failed to update the state: ' + util.join(full, ', '))
+
+    def trueGoal(self, i):
+        try:
+            return self.trueGoals[i]
+        except KeyError:
+            goal = Struct('true', [self.gd.stateTerm(i)]).prolog(self.fluentPredicates)
+            self.trueGoals[i] = goal
+            return goal
+
+    def clearGoal(self, pred):
+        # abolish would drop the thread_local or dynamic declaration
+        if self.threadLocal or self.fluentPredicates:
+            return self.retractAllGoal(pred)
+        return "abolish(" + pred + ")"
+
+    def retractAllGoal(self, pred):
+        name, arity = pred.split('/')
+        if arity == '0':
+            return "retractall(" + name + ")"
+        args = util.join(['_'] * int(arity), ',')
+        return "retractall(" + name + "(" + args + "))"
+
+    def doesTerm(self, role, move, op):
+        return op + "(does(" + self.gd.roleTerm(role).prolog() + \
+               ", " + self.gd.movePrologTerm(move) + "))"
 
     def isTerminal(self, state):
         self.assertTrue(state)
-        result = self.prolog.run("terminal.")
-        return result
+        return len(self.terminalQuery()) > 0
 
     def computeGoals(self, state):
+        # One query for all roles
         self.assertTrue(state)
-        queries = ["goal(" + r.prolog() + ", X)." \
-                   for r in self.gd.roles]
-        results = [int(self.prolog.run(q)[0]["X"]) \
-                   for q in queries]
+        return self.goalValues(self.goalQuery(None, None))
+
+    def goalValues(self, solutions):
+        """
+        Goal value of each role from (role, value) solutions of
+        goal/2, keeping the first one found for each role
+        """
+        results = [None for _ in self.gd.roles]
+        for r, x in solutions:
+            i = self.roleIndex[str(r)]
+            if results[i] is None:
+                results[i] = int(x)
+        for i, x in enumerate(results):
+            if x is None:
+                raise Exception('No goal value for role: ' + \
+                                str(self.gd.roleTerm(i)))
         return results
 
     def computeLegalMoves(self, state):
+        if self.turns is not None:
+            idle = self.turns.idleMoves(state)
+            if None not in idle:
+                return [[m] for m in idle]
+            if idle.count(None) < len(idle):
+                return self.computeActiveLegalMoves(state, idle)
+        # One query for all roles
         self.assertTrue(state)
-        queries = ["legal(" + r.prolog() + ", X)." \
-                   for r in self.gd.roles]
         results = [set() for _ in self.gd.roles]
-        for i, q in enumerate(queries):
-            for x in self.prolog.run(q):
-                results[i].add(self.gd.movePrologIndex(x["X"]))
-            results[i] = list(results[i])
+        for r, x in self.legalQuery(None, None):
+            results[self.roleIndex[str(r)]].add(self.gd.moveValueIndex(x))
+        return [list(r) for r in results]
+
+    def computeActiveLegalMoves(self, state, idle):
+        "One query per role whose only move is not known"
+        self.assertTrue(state)
+        results = []
+        for r, m in enumerate(idle):
+            if m is None:
+                role = self.gd.roleTerm(r).prologValue()
+                moves = set([self.gd.moveValueIndex(x) for _, x in self.legalQuery(role, None)])
+                results.append(list(moves))
+            else:
+                results.append([m])
         return results
         
     def computeNextState(self, state, moves):
         self.assertTrue(state)
         self.assertDoes(moves)
-        results = State()
-        for x in self.prolog.run("next(X)."):
-            results.add(self.gd.statePrologIndex(x["X"]))
+        results = [self.gd.stateValueIndex(x) for x, in self.nextQuery(None)]
+        return self.gd.makeState(results)
+
+    def doesValues(self, moves):
+        "does/2 facts of a joint move as pyswipl values"
+        results = []
+        for r, m in enumerate(moves):
+            try:
+                value = self.moveValues[m]
+            except KeyError:
+                value = self.gd.moveTerm(m).prologValue()
+                self.moveValues[m] = value
+            results.append(('does', self.gd.roleTerm(r).prologValue(), value))
         return results
 
+    def computeAllNextStates(self, state, jointMovesList):
+        """
+        Next state for each joint move, in the same order, with
+        a single query that asserts the does facts of each joint
+        move in turn
+        """
+        if len(jointMovesList) == 0:
+            return []
+        self.assertTrue(state)
+        # The query leaves does/2 holding the last joint move
+        self.moves = None
+        does = [self.doesValues(m) for m in jointMovesList]
+        [(_, results)] = self.allNextQuery(does, None)
+        self.moves = list(jointMovesList[-1])
+        return [self.gd.makeState([self.gd.stateValueIndex(x) for x in r]) \
+                for r in results]
+
+    def playout(self, state, seed, policy='random', recordMoves=False):
+        """
+        Play random moves from state until a terminal state, in
+        a single Prolog query.  Returns the goal values and the
+        number of steps, and with recordMoves set the joint move
+        of each step.
+        """
+        if policy != 'random':
+            raise Exception('Unsupported playout policy: ' + str(policy))
+        self.assertTrue(state)
+        # The query leaves its own state and moves asserted
+        self.state = None
+        self.moves = None
+        roles = [r.prologValue() for r in self.gd.roles]
+        results = self.playoutQuery(roles, seed, None, None, None)
+        if len(results) == 0:
+            raise Exception('Playout reached a state without legal moves')
+        _, _, depth, goalValues, moveValues = results[0]
+        goals = self.goalValues([(r, x) for _, r, x in goalValues])
+        if not recordMoves:
+            return goals, depth
+        moves = [[self.gd.moveValueIndex(m) for m in ms] for ms in moveValues]
+        return goals, depth, moves
+
     def prologQuery(self, q, state=None, moves=None):
         if state:
             self.assertTrue(state)
@@ -97,63 +388,160 @@ class SimCache:
             self.next ={}
 
     class Moves(list):
+        "Joint move hashed by the Zobrist keys of its moves in gd"
+        def __init__(self, moves, gd):
+            list.__init__(self, moves)
+            self.hash = 0
+            for r, x in enumerate(moves):
+                self.hash ^= gd.zobristMoveKey(r, x)
         def __hash__(self):
-            h = 1311743
-            for x in self:
-                h ^= x*(x+1)
-            return h
+            return self.hash
 
-    def __init__(self, sim):
+    def __init__(self, sim, symmetries=None, capacity=64 * 1024 * 1024):
         self.sim = sim
-        from ggp.cache import FIFOCache
-        self.lookup = FIFOCache()
+        self.symmetries = symmetries
+        from ggp.cache import ClockCache
+        self.lookup = ClockCache(capacity, self.entrySize)
+
+    def canonical(self, state):
+        """
+        Key of state in the cache, and the symmetry that maps
+        state to it
+        """
+        if self.symmetries is None:
+            return state, None
+        return self.symmetries.canonical(state)
+
+    def entrySize(self, state, rec):
+        """
+        Estimated bytes of a cache entry, counting each next
+        state as the size of state and its joint move
+        """
+        stateSize = sys.getsizeof(state)
+        size = stateSize + sys.getsizeof(rec) + sys.getsizeof(rec.__dict__) + \
+               sys.getsizeof(rec.next)
+        if rec.legal is not None:
+            size += sum([sys.getsizeof(l) for l in rec.legal])
+        if len(rec.next) > 0:
+            moves = next(iter(rec.next))
+            size += len(rec.next) * (stateSize + sys.getsizeof(moves))
+        return size
+
+    def record(self, state):
+        rec = self.lookup.get(state)
+        if rec is None:
+            rec = self.LookupRec()
+        return rec
 
     def isTerminal(self, state):
-        if state in self.lookup:
-            if self.lookup[state].terminal != None:
-                return self.lookup[state].terminal
-        else:
-            self.lookup[state] = self.LookupRec()
-        result = self.sim.isTerminal(state)
-        self.lookup[state].terminal = result
-        return result
+        state, k = self.canonical(state)
+        rec = self.record(state)
+        if rec.terminal == None:
+            rec.terminal = self.sim.isTerminal(state)
+            self.lookup[state] = rec
+        return rec.terminal
 
     def computeGoals(self, state):
-        if state in self.lookup:
-            if self.lookup[state].goals != None:
-                return self.lookup[state].goals
-        else:
-            self.lookup[state] = self.LookupRec()
-        result = self.sim.computeGoals(state)
-        self.lookup[state].goals = result
-        return result
+        state, k = self.canonical(state)
+        rec = self.record(state)
+        if rec.goals == None:
+            rec.goals = self.sim.computeGoals(state)
+            self.lookup[state] = rec
+        return rec.goals
 
     def computeLegalMoves(self, state):
-        if state in self.lookup:
-            if self.lookup[state].legal != None:
-                return self.lookup[state].legal
-        else:
-            self.lookup[state] = self.LookupRec()
-        result = self.sim.computeLegalMoves(state)
-        self.lookup[state].legal = result
-        return result
+        state, k = self.canonical(state)
+        rec = self.record(state)
+        if rec.legal == None:
+            rec.legal = self.sim.computeLegalMoves(state)
+            self.lookup[state] = rec
+        return self.unmapMoves(rec.legal, k)
+
+    def unmapMoves(self, legal, k):
+        if k is None:
+            return legal
+        return [[self.symmetries.mapMove(m, k, True) for m in ms] for ms in legal]
 
     def computeNextState(self, state, m):
-        mp = None
-        if state not in self.lookup:
-            self.lookup[state] = self.LookupRec()
-        mp = self.lookup[state].next
-        moves = self.Moves(m)
-        if moves in mp :
+        state, k = self.canonical(state)
+        rec = self.record(state)
+        mp = rec.next
+        moves = self.Moves(m, self.sim.gd)
+        if k is not None:
+            moves = self.Moves([self.symmetries.mapMove(x, k) for x in m], self.sim.gd)
+        if moves not in mp:
+            mp[moves] = self.sim.computeNextState(state, moves)
+            self.lookup[state] = rec
+        if k is None:
             return mp[moves]
-        result = self.sim.computeNextState(state, moves)
-        mp[moves] = result
-        return result
+        return self.symmetries.mapState(mp[moves], k, True)
+
+    def computeAllNextStates(self, state, jointMovesList):
+        state, k = self.canonical(state)
+        rec = self.record(state)
+        mp = rec.next
+        if k is None:
+            keys = [self.Moves(m, self.sim.gd) for m in jointMovesList]
+        else:
+            keys = [self.Moves([self.symmetries.mapMove(x, k) for x in m], self.sim.gd) \
+                    for m in jointMovesList]
+        missing = [key for key in keys if key not in mp]
+        if len(missing) > 0:
+            results = self.sim.computeAllNextStates(state, missing)
+            for key, result in zip(missing, results):
+                mp[key] = result
+            self.lookup[state] = rec
+        if k is None:
+            return [mp[key] for key in keys]
+        return [self.symmetries.mapState(mp[key], k, True) for key in keys]
 
     def __getattr__(self, attr):
         return getattr(self.sim, attr)
 
 
 class CachedSimulator(SimCache):
-    def __init__(self, gd):
-        SimCache.__init__(self, PrologSimulator(gd))
+    "SimCache over a simClass simulator built with keyword arguments simArgs"
+    def __init__(self, gd, simClass=PrologSimulator, symmetries=None, simArgs={}):
+        SimCache.__init__(self, simClass(gd, **simArgs), symmetries)
+
+
+def randomPlayout(sim, state, seed, policy='random', recordMoves=False):
+    """
+    playout for simulators that have no loop of their own, with
+    the same arguments and results as PrologSimulator.playout
+    """
+    if policy != 'random':
+        raise Exception('Unsupported playout policy: ' + str(policy))
+    rng = random.Random(seed)
+    moves = []
+    while not sim.isTerminal(state):
+        legal = sim.computeLegalMoves(state)
+        for l in legal:
+            if len(l) == 0:
+                raise Exception('Playout reached a state without legal moves')
+        joint = [rng.choice(l) for l in legal]
+        moves.append(joint)
+        state = sim.computeNextState(state, joint)
+    goals = sim.computeGoals(state)
+    if not recordMoves:
+        return goals, len(moves)
+    return goals, len(moves), moves
+
+
+def simulatorClass(name):
+    """
+    Simulator backend by name.  Backends other than prolog
+    are imported on demand.
+    """
+    if name == 'prolog':
+        return PrologSimulator
+    elif name == 'propnet':
+        from ggp.propnet import PropNetSimulator
+        return PropNetSimulator
+    elif name == 'reasoner':
+        from ggp.reasoner import ReasonerSimulator
+        return ReasonerSimulator
+    elif name == 'compiled':
+        from ggp.compiler import CompiledSimulator
+        return CompiledSimulator
+    raise Exception('Unknown simulator: ' + str(name))
@@ -0,0 +1,191 @@
+from ggp.kif import Struct
+from ggp.ground import Grounding
+from ggp.util import stronglyConnected, isint
+
+# Dihedral transforms of an n by n board, except the identity
+BOARD_TRANSFORMS = [
+    lambda x, y, n: (n - 1 - x, y),
+    lambda x, y, n: (x, n - 1 - y),
+    lambda x, y, n: (n - 1 - x, n - 1 - y),
+    lambda x, y, n: (y, x),
+    lambda x, y, n: (n - 1 - y, n - 1 - x),
+    lambda x, y, n: (y, n - 1 - x),
+    lambda x, y, n: (n - 1 - y, x),
+]
+
+class Symmetries:
+    """
+    Board symmetries of a game and canonical states.
+
+    Boards are fluent or move functors with two arguments over
+    the same set of constants, which are recorded in gd.boards
+    as functor -> (i, j).  The coordinates are ordered by a
+    relation from gd.orderings when one covers them, and
+    otherwise numerically or by name.  Each rotation and
+    reflection of the boards is a candidate, kept only if it
+    maps the grounded rules onto themselves with legal, next,
+    goal and terminal mapped as expected.
+
+    Symmetry k maps fluent indexes with fluentMaps[k] and move
+    indexes with moveMaps[k].
+    """
+    def __init__(self, gd, grounding=None):
+        self.gd = gd
+        if grounding is None:
+            grounding = Grounding(gd)
+        self.grounding = grounding
+        self.fluents = [a.terms[0] for a in grounding.allAtoms() if a.name == 'true']
+        self.moves = set([a.terms[1] for a in grounding.allAtoms() if a.name == 'does'])
+        self.signatures()
+        gd.processRelationals()
+
+        self.fluentMaps = []
+        self.moveMaps = []
+        self.inverseFluentMaps = []
+        self.inverseMoveMaps = []
+        for coords, functors in self.findBoards().items():
+            order = self.coordinateOrder(coords)
+            for transform in BOARD_TRANSFORMS:
+                mapping = self.boardMapping(functors, order, transform)
+                if self.isSymmetry(mapping):
+                    self.addSymmetry(mapping)
+
+    def findBoards(self):
+        "Board functors grouped by their set of coordinates"
+        boards = {}
+        for functor in self.gd.stateVars | self.gd.actions:
+            for i in range(functor.arity):
+                for j in range(i + 1, functor.arity):
+                    if functor in self.gd.boards:
+                        break
+                    coords = self.gd.domains.get(functor.relationDomain(i))
+                    if coords and len(coords) > 1 and \
+                       coords == self.gd.domains.get(functor.relationDomain(j)) and \
+                       max([f.arity for f in coords]) == 0:
+                        self.gd.boards[functor] = (i, j)
+                        key = frozenset([f.name for f in coords])
+                        boards.setdefault(key, []).append(functor)
+        return boards
+
+    def coordinateOrder(self, coords):
+        for ordering in self.gd.orderings.values():
+            names = [s.name for s in ordering]
+            if set(names) == coords:
+                return names
+        if len([c for c in coords if not isint(c)]) == 0:
+            return sorted(coords, key=int)
+        return sorted(coords)
+
+    def boardMapping(self, functors, order, transform):
+        "Term to term mapping of one transform of the boards"
+        n = len(order)
+        position = dict([(c, k) for k, c in enumerate(order)])
+        def mapTerm(t):
+            if t.functor() not in functors:
+                return t
+            i, j = self.gd.boards[t.functor()]
+            x, y = transform(position[t.terms[i].name], position[t.terms[j].name], n)
+            terms = list(t.terms)
+            terms[i] = Struct(order[x])
+            terms[j] = Struct(order[y])
+            return Struct(t.name, terms)
+        return mapTerm
+
+    def signatures(self):
+        """
+        Signature of every ground atom: the set of bodies of its
+        rules, over the representative atoms of each signature
+        """
+        graph = {}
+        self.rules = {}
+        for r in self.grounding.rules:
+            if r.head.name != 'init':
+                graph.setdefault(r.head, set()).update(r.pos + r.neg)
+                self.rules.setdefault(r.head, []).append(r)
+        for atoms in graph.values():
+            for a in list(atoms):
+                graph.setdefault(a, set())
+        self.order = stronglyConnected(graph)
+        self.acyclic = len([c for c in self.order \
+                            if len(c) > 1 or c[0] in graph[c[0]]]) == 0
+        self.rep = {}
+        self.sig = {}
+        self.sigAtoms = {}
+        for component in self.order:
+            a = component[0]
+            if a.name == 'true' or a.name == 'does':
+                self.rep[a] = a
+                continue
+            self.sig[a] = self.signature(a, self.rep)
+            self.rep[a] = self.sigAtoms.setdefault(self.sig[a], a)
+
+    def signature(self, a, rep):
+        return frozenset([(frozenset([rep[p] for p in r.pos]),
+                           frozenset([rep[n] for n in r.neg])) \
+                          for r in self.rules.get(a, ())])
+
+    def isSymmetry(self, mapTerm):
+        "Whether the term mapping maps the grounded rules onto themselves"
+        if not self.acyclic:
+            return False
+        image = {}
+        for component in self.order:
+            a = component[0]
+            if a.name == 'true':
+                b = Struct('true', [mapTerm(a.terms[0])])
+            elif a.name == 'does':
+                b = Struct('does', [a.terms[0], mapTerm(a.terms[1])])
+            else:
+                b = self.sigAtoms.get(self.signature(a, image))
+            if b is None or b not in self.rep:
+                return False
+            image[a] = self.rep[b]
+            if a.name == 'legal':
+                expected = Struct('legal', [a.terms[0], mapTerm(a.terms[1])])
+            elif a.name == 'next':
+                expected = Struct('next', [mapTerm(a.terms[0])])
+            elif a.name == 'goal' or (a.name == 'terminal' and a.arity() == 0):
+                expected = a
+            else:
+                continue
+            if self.rep.get(expected) != image[a]:
+                return False
+        return True
+
+    def addSymmetry(self, mapTerm):
+        gd = self.gd
+        fluents = dict([(gd.stateIndex(t), gd.stateIndex(mapTerm(t))) \
+                        for t in self.fluents])
+        moves = dict([(gd.moveIndex(t), gd.moveIndex(mapTerm(t))) \
+                      for t in self.moves])
+        self.fluentMaps.append(fluents)
+        self.moveMaps.append(moves)
+        self.inverseFluentMaps.append(dict([(y, x) for x, y in fluents.items()]))
+        self.inverseMoveMaps.append(dict([(y, x) for x, y in moves.items()]))
+
+    def canonical(self, state):
+        """
+        Representative of the states symmetric to state, and the
+        symmetry that maps state to it (None for the identity)
+        """
+        best = sorted(state)
+        symmetry = None
+        for k, fluents in enumerate(self.fluentMaps):
+            key = sorted([fluents.get(x, x) for x in state])
+            if key < best:
+                best = key
+                symmetry = k
+        if symmetry is None:
+            return state, None
+        return self.gd.makeState(best), symmetry
+
+    def mapState(self, state, k, inverse=False):
+        if k is None:
+            return state
+        fluents = (inverse and self.inverseFluentMaps or self.fluentMaps)[k]
+        return self.gd.makeState([fluents.get(x, x) for x in state])
+
+    def mapMove(self, m, k, inverse=False):
+        if k is None:
+            return m
+        return (inverse and self.inverseMoveMaps or self.moveMaps)[k].get(m, m)
@@ -0,0 +1,63 @@
+from ggp.propnet import PropNet, BASE
+from ggp.invariant import ThreeValued
+
+class TurnTaking(ThreeValued):
+    """
+    Static turn-taking analysis on the propositional network.
+
+    A control fluent is a fluent that the legal rules depend on
+    and whose value alone leaves a role a single possible move,
+    such as control(xplayer) for oplayer in tic-tac-toe.  Each
+    fluent the legal rules read is tried true and false with
+    the other fluents unknown.  The move that is left is the
+    only legal one since every role has a legal move in every
+    reachable state.
+
+    idle holds, per role, (fluent index, value, move index)
+    conditions: when the fluent is in the state if value is
+    True, or missing from it if value is False, the role can
+    only play the move.
+    """
+    def __init__(self, gd, net=None):
+        self.gd = gd
+        if net is None:
+            net = PropNet(gd)
+        ThreeValued.__init__(self, net)
+        self.idle = [[] for _ in gd.roles]
+        self.controls = set()
+        components = self.legalBases()
+        for i, base in sorted(net.bases.items()):
+            if base not in components:
+                continue
+            for value in (True, False):
+                sure, maybe = self.evaluate({base: value})
+                for r, legals in enumerate(net.legals):
+                    moves = [m for c, m in legals if maybe[c]]
+                    if len(moves) == 1:
+                        self.idle[r].append((i, value, moves[0]))
+                        self.controls.add(i)
+
+    def legalBases(self):
+        "Base propositions that some legal proposition depends on"
+        net = self.net
+        seen = set()
+        pending = [c for legals in net.legals for c, m in legals]
+        while pending:
+            c = pending.pop()
+            if c not in seen:
+                seen.add(c)
+                if net.kinds[c] != BASE:
+                    pending.extend(net.inputs[c])
+        return seen
+
+    def idleMoves(self, state):
+        "The only move of each role in state, None if it is not known"
+        results = []
+        for conditions in self.idle:
+            move = None
+            for i, value, m in conditions:
+                if (i in state) == value:
+                    move = m
+                    break
+            results.append(move)
+        return results
@@ -77,5 +77,47 @@ def shuffle(lst):
 def joinfuncs(funcs):
     return lambda *x: [func(*x) for func in funcs]
 
-            
-        
+def stronglyConnected(graph):
+    """
+    Strongly connected components of a graph given as a map
+    from each node to its successors (Tarjan's algorithm).
+    Each component is listed after every component it reaches.
+    """
+    index = {}
+    low = {}
+    stack = []
+    onStack = set()
+    components = []
+    for root in graph:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        onStack.add(root)
+        work = [(root, iter(graph.get(root, ())))]
+        while work:
+            node, succs = work[-1]
+            for s in succs:
+                if s not in index:
+                    index[s] = low[s] = len(index)
+                    stack.append(s)
+                    onStack.add(s)
+                    work.append((s, iter(graph.get(s, ()))))
+                    break
+                elif s in onStack:
+                    low[node] = min(low[node], index[s])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        x = stack.pop()
+                        onStack.discard(x)
+                        component.append(x)
+                        if x == node:
+                            break
+                    components.append(component)
+    return components
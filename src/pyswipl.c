@@ -1,5 +1,38 @@
 #include "Python.h"
 #include "SWI-Prolog.h"
+#include <string.h>
+
+
+/**********************************************************/
+/* Queries release the GIL, so the GIL no longer keeps    */
+/* two threads out of the same engine.  A thread must     */
+/* have an engine of its own: the main thread has the     */
+/* main engine and other threads attach one created with  */
+/* create_engine (see set_engine).  Queries from a thread */
+/* without an engine are refused.                         */
+/**********************************************************/
+static int pyswipl_check_engine(void) {
+	if(PL_thread_self() == -1) {
+		PyErr_SetString(PyExc_RuntimeError,
+				"pyswipl: no Prolog engine attached to this thread, see set_engine");
+		return 0;
+	}
+	return 1;
+}
+
+/**********************************************************/
+/* Fetch the next solution of a query without holding the */
+/* GIL, so other Python threads keep running while Prolog */
+/* works.                                                 */
+/**********************************************************/
+static int pyswipl_next_solution(qid_t swipl_qid) {
+int result;
+
+	Py_BEGIN_ALLOW_THREADS
+	result=PL_next_solution(swipl_qid);
+	Py_END_ALLOW_THREADS
+	return result;
+}
 
 
 static PyObject* pyswipl_run(PyObject* self_Py, PyObject* args_Py) {
@@ -28,6 +61,8 @@ fid_t swipl_fid;
 	/**********************************************************/
 	if(!PyArg_ParseTuple(args_Py, "s", &goalString))
 		return NULL;
+	if(!pyswipl_check_engine())
+		return NULL;
 	else {
 
 		/**********************************************************/
@@ -60,7 +95,7 @@ fid_t swipl_fid;
 		/* Open the query, and iterate through the solutions.     */
 		/**********************************************************/
 		swipl_qid=PL_open_query(NULL,PL_Q_NORMAL,swipl_predicate, swipl_args);
-		while(PL_next_solution(swipl_qid)) {
+		while(pyswipl_next_solution(swipl_qid)) {
 
 			/**********************************************************/
 			/* Create a Python list to hold the bindings.             */
@@ -101,8 +136,361 @@ fid_t swipl_fid;
 	}
 }
 
+/**********************************************************/
+/* Convert a Prolog term to a Python object:              */
+/*   atom      -> string                                  */
+/*   integer   -> int                                     */
+/*   float     -> float                                   */
+/*   list      -> list                                    */
+/*   compound  -> tuple (name, arg1, ..., argN)           */
+/*   variable  -> None                                    */
+/**********************************************************/
+static PyObject* pyswipl_term(term_t swipl_term) {
+char* chars;
+size_t length;
+int64_t integer;
+double real;
+atom_t name;
+int arity;
+int i;
+term_t swipl_arg;
+term_t swipl_head;
+term_t swipl_list;
+PyObject* result_Py;
+PyObject* item_Py;
+
+	switch(PL_term_type(swipl_term)) {
+	case PL_VARIABLE:
+		Py_RETURN_NONE;
+#ifdef PL_NIL
+	case PL_NIL:
+		return PyList_New(0);
+#endif
+	case PL_ATOM:
+		if(!PL_get_atom_chars(swipl_term, &chars))
+			break;
+		return PyString_FromString(chars);
+	case PL_INTEGER:
+		if(!PL_get_int64(swipl_term, &integer))
+			break;
+		return PyInt_FromLong((long)integer);
+	case PL_FLOAT:
+		if(!PL_get_float(swipl_term, &real))
+			break;
+		return PyFloat_FromDouble(real);
+	case PL_STRING:
+		if(!PL_get_string_chars(swipl_term, &chars, &length))
+			break;
+		return PyString_FromStringAndSize(chars, length);
+	default:
+		if(PL_is_list(swipl_term)) {
+			result_Py=PyList_New(0);
+			swipl_head=PL_new_term_ref();
+			swipl_list=PL_copy_term_ref(swipl_term);
+			while(PL_get_list(swipl_list, swipl_head, swipl_list)) {
+				item_Py=pyswipl_term(swipl_head);
+				if(item_Py == NULL) {
+					Py_DECREF(result_Py);
+					return NULL;
+				}
+				PyList_Append(result_Py, item_Py);
+				Py_DECREF(item_Py);
+			}
+			return result_Py;
+		}
+		if(!PL_get_name_arity(swipl_term, &name, &arity))
+			break;
+		result_Py=PyTuple_New(arity+1);
+		PyTuple_SET_ITEM(result_Py, 0, PyString_FromString(PL_atom_chars(name)));
+		swipl_arg=PL_new_term_ref();
+		for(i=1; i<=arity; i++) {
+			PL_get_arg(i, swipl_term, swipl_arg);
+			item_Py=pyswipl_term(swipl_arg);
+			if(item_Py == NULL) {
+				Py_DECREF(result_Py);
+				return NULL;
+			}
+			PyTuple_SET_ITEM(result_Py, i, item_Py);
+		}
+		return result_Py;
+	}
+	PyErr_SetString(PyExc_ValueError, "pyswipl: cannot convert Prolog term");
+	return NULL;
+}
+
+
+/**********************************************************/
+/* Same as run, but each solution is a list of            */
+/* (name, value) pairs with the value converted by        */
+/* pyswipl_term instead of written out as a string.       */
+/**********************************************************/
+static PyObject* pyswipl_runterms(PyObject* self_Py, PyObject* args_Py) {
+char* goalString;
+char* varName;
+int arity;
+atom_t name;
+
+PyObject* answerList_Py;
+PyObject* bindingList_Py;
+PyObject* value_Py;
+PyObject* binding_Py;
+
+term_t swipl_args;
+term_t swipl_goalCharList;
+term_t swipl_bindingList;
+term_t swipl_head;
+term_t swipl_list;
+term_t swipl_var;
+term_t swipl_value;
+predicate_t swipl_predicate;
+qid_t swipl_qid;
+fid_t swipl_fid;
+
+	if(!PyArg_ParseTuple(args_Py, "s", &goalString))
+		return NULL;
+	if(!pyswipl_check_engine())
+		return NULL;
+
+	answerList_Py=PyList_New(0);
+
+	swipl_fid=PL_open_foreign_frame();
+	swipl_head=PL_new_term_ref();
+	swipl_var=PL_new_term_ref();
+	swipl_value=PL_new_term_ref();
+	swipl_args=PL_new_term_refs(2);
+	swipl_goalCharList=swipl_args;
+	swipl_bindingList=swipl_args+1;
+
+	PL_put_list_chars(swipl_goalCharList,goalString);
+	swipl_predicate=PL_predicate("pyrun",2,NULL);
+
+	swipl_qid=PL_open_query(NULL,PL_Q_NORMAL,swipl_predicate, swipl_args);
+	while(pyswipl_next_solution(swipl_qid)) {
+		bindingList_Py=PyList_New(0);
+
+		/**********************************************************/
+		/* Each binding is a Name=Value term.                     */
+		/**********************************************************/
+		swipl_list=PL_copy_term_ref(swipl_bindingList);
+		while(PL_get_list(swipl_list, swipl_head, swipl_list)) {
+			if(!PL_get_name_arity(swipl_head, &name, &arity) || arity != 2)
+				continue;
+			PL_get_arg(1, swipl_head, swipl_var);
+			PL_get_arg(2, swipl_head, swipl_value);
+			if(!PL_get_atom_chars(swipl_var, &varName))
+				continue;
+			value_Py=pyswipl_term(swipl_value);
+			if(value_Py == NULL) {
+				Py_DECREF(bindingList_Py);
+				Py_DECREF(answerList_Py);
+				PL_close_query(swipl_qid);
+				PL_discard_foreign_frame(swipl_fid);
+				return NULL;
+			}
+			binding_Py=Py_BuildValue("(sN)", varName, value_Py);
+			PyList_Append(bindingList_Py, binding_Py);
+			Py_DECREF(binding_Py);
+		}
+
+		PyList_Append(answerList_Py, bindingList_Py);
+		Py_DECREF(bindingList_Py);
+	}
+
+	PL_close_query(swipl_qid);
+	PL_discard_foreign_frame(swipl_fid);
+
+	return answerList_Py;
+}
+
+/**********************************************************/
+/* Put a Python object into a Prolog term, the inverse of */
+/* pyswipl_term.  None becomes a fresh variable.          */
+/**********************************************************/
+static int pyswipl_put(term_t swipl_term, PyObject* object_Py) {
+Py_ssize_t size;
+Py_ssize_t i;
+atom_t name;
+term_t swipl_args;
+term_t swipl_head;
+int ok;
+
+	if(object_Py == Py_None)
+		return PL_put_variable(swipl_term);
+	if(PyString_Check(object_Py))
+		return PL_put_atom_chars(swipl_term, PyString_AsString(object_Py));
+	if(PyInt_Check(object_Py))
+		return PL_put_int64(swipl_term, PyInt_AsLong(object_Py));
+	if(PyLong_Check(object_Py))
+		return PL_put_int64(swipl_term, PyLong_AsLongLong(object_Py));
+	if(PyFloat_Check(object_Py))
+		return PL_put_float(swipl_term, PyFloat_AsDouble(object_Py));
+	if(PyList_Check(object_Py)) {
+		swipl_head=PL_new_term_ref();
+		PL_put_nil(swipl_term);
+		for(i=PyList_GET_SIZE(object_Py)-1; i>=0; i--) {
+			if(!pyswipl_put(swipl_head, PyList_GET_ITEM(object_Py, i)) ||
+			   !PL_cons_list(swipl_term, swipl_head, swipl_term))
+				return FALSE;
+		}
+		return TRUE;
+	}
+	if(PyTuple_Check(object_Py) && PyTuple_GET_SIZE(object_Py) > 0 &&
+	   PyString_Check(PyTuple_GET_ITEM(object_Py, 0))) {
+		size=PyTuple_GET_SIZE(object_Py)-1;
+		if(size == 0)
+			return PL_put_atom_chars(swipl_term,
+			                         PyString_AsString(PyTuple_GET_ITEM(object_Py, 0)));
+		swipl_args=PL_new_term_refs(size);
+		for(i=0; i<size; i++) {
+			if(!pyswipl_put(swipl_args+i, PyTuple_GET_ITEM(object_Py, i+1)))
+				return FALSE;
+		}
+		name=PL_new_atom(PyString_AsString(PyTuple_GET_ITEM(object_Py, 0)));
+		ok=PL_cons_functor_v(swipl_term, PL_new_functor(name, size), swipl_args);
+		PL_unregister_atom(name);
+		return ok;
+	}
+	PyErr_SetString(PyExc_TypeError, "pyswipl: cannot convert object to Prolog term");
+	return FALSE;
+}
+
+
+/**********************************************************/
+/* Look up a predicate once, so that it can be called     */
+/* many times without parsing a query string.             */
+/**********************************************************/
+static PyObject* pyswipl_predicate(PyObject* self_Py, PyObject* args_Py) {
+char* name;
+int arity;
+char* module=NULL;
+
+	if(!PyArg_ParseTuple(args_Py, "si|s", &name, &arity, &module))
+		return NULL;
+	return PyCapsule_New((void*)PL_predicate(name, arity, module), "pyswipl.predicate", NULL);
+}
+
+
+/**********************************************************/
+/* Call a predicate returned by pyswipl.predicate with a  */
+/* tuple of arguments, converted by pyswipl_put.  Returns */
+/* a list with one tuple of argument values per solution. */
+/* The tuple must have one item per predicate argument.   */
+/**********************************************************/
+static PyObject* pyswipl_call(PyObject* self_Py, PyObject* args_Py) {
+PyObject* predicate_Py;
+PyObject* callArgs_Py;
+PyObject* answerList_Py;
+PyObject* solution_Py;
+PyObject* value_Py;
+Py_ssize_t arity;
+Py_ssize_t i;
+
+predicate_t swipl_predicate;
+atom_t swipl_name;
+#if PLVERSION >= 70000
+size_t swipl_arity;
+#else
+int swipl_arity;
+#endif
+term_t swipl_args;
+qid_t swipl_qid;
+fid_t swipl_fid;
+
+	if(!PyArg_ParseTuple(args_Py, "OO!", &predicate_Py, &PyTuple_Type, &callArgs_Py))
+		return NULL;
+	if(!pyswipl_check_engine())
+		return NULL;
+	swipl_predicate=(predicate_t)PyCapsule_GetPointer(predicate_Py, "pyswipl.predicate");
+	if(swipl_predicate == NULL)
+		return NULL;
+
+	arity=PyTuple_GET_SIZE(callArgs_Py);
+	if(!PL_predicate_info(swipl_predicate, &swipl_name, &swipl_arity, NULL))
+		return PyErr_Format(PyExc_RuntimeError, "pyswipl: unknown predicate");
+	if(arity != (Py_ssize_t)swipl_arity)
+		return PyErr_Format(PyExc_TypeError, "pyswipl: %s/%d called with %d arguments",
+				    PL_atom_chars(swipl_name), (int)swipl_arity, (int)arity);
+	swipl_fid=PL_open_foreign_frame();
+	swipl_args=PL_new_term_refs(arity);
+	for(i=0; i<arity; i++) {
+		if(!pyswipl_put(swipl_args+i, PyTuple_GET_ITEM(callArgs_Py, i))) {
+			PL_discard_foreign_frame(swipl_fid);
+			return NULL;
+		}
+	}
+
+	answerList_Py=PyList_New(0);
+	swipl_qid=PL_open_query(NULL,PL_Q_NORMAL,swipl_predicate,swipl_args);
+	while(pyswipl_next_solution(swipl_qid)) {
+		solution_Py=PyTuple_New(arity);
+		for(i=0; i<arity; i++) {
+			value_Py=pyswipl_term(swipl_args+i);
+			if(value_Py == NULL) {
+				Py_DECREF(solution_Py);
+				Py_DECREF(answerList_Py);
+				PL_close_query(swipl_qid);
+				PL_discard_foreign_frame(swipl_fid);
+				return NULL;
+			}
+			PyTuple_SET_ITEM(solution_Py, i, value_Py);
+		}
+		PyList_Append(answerList_Py, solution_Py);
+		Py_DECREF(solution_Py);
+	}
+	PL_close_query(swipl_qid);
+	PL_discard_foreign_frame(swipl_fid);
+
+	return answerList_Py;
+}
+
+/**********************************************************/
+/* Engines.  Each engine has its own stacks, so threads   */
+/* that attach different engines can query concurrently.  */
+/* The clause database is shared, except for predicates   */
+/* declared thread_local.                                 */
+/**********************************************************/
+static void pyswipl_destroy_engine(PyObject* engine_Py) {
+	PL_destroy_engine((PL_engine_t)PyCapsule_GetPointer(engine_Py, "pyswipl.engine"));
+}
+
+static PyObject* pyswipl_create_engine(PyObject* self_Py, PyObject* args_Py) {
+PL_thread_attr_t swipl_attr;
+PL_engine_t swipl_engine;
+
+	memset(&swipl_attr, 0, sizeof(swipl_attr));
+	swipl_engine=PL_create_engine(&swipl_attr);
+	if(swipl_engine == NULL) {
+		PyErr_SetString(PyExc_RuntimeError, "pyswipl: cannot create engine");
+		return NULL;
+	}
+	return PyCapsule_New((void*)swipl_engine, "pyswipl.engine", pyswipl_destroy_engine);
+}
+
+static PyObject* pyswipl_set_engine(PyObject* self_Py, PyObject* args_Py) {
+PyObject* engine_Py;
+PL_engine_t swipl_engine=NULL;
+
+	if(!PyArg_ParseTuple(args_Py, "O", &engine_Py))
+		return NULL;
+	if(engine_Py != Py_None) {
+		swipl_engine=(PL_engine_t)PyCapsule_GetPointer(engine_Py, "pyswipl.engine");
+		if(swipl_engine == NULL)
+			return NULL;
+	}
+	if(PL_set_engine(swipl_engine, NULL) != PL_ENGINE_SET) {
+		PyErr_SetString(PyExc_RuntimeError, "pyswipl: cannot attach engine");
+		return NULL;
+	}
+	Py_RETURN_NONE;
+}
+
 static PyMethodDef pyswiplMethods[] = {
 	{"run", pyswipl_run, METH_VARARGS},
+	{"runterms", pyswipl_runterms, METH_VARARGS},
+	{"predicate", pyswipl_predicate, METH_VARARGS},
+	{"call", pyswipl_call, METH_VARARGS},
+	{"create_engine", pyswipl_create_engine, METH_NOARGS},
+	{"set_engine", pyswipl_set_engine, METH_VARARGS},
 	{NULL,NULL}
 };
 